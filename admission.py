@@ -0,0 +1,383 @@
+import asyncio
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional
+
+from sqlalchemy.orm import Session, sessionmaker
+from starlette.responses import PlainTextResponse
+
+from database import SessionLocal
+from models import Trip, Ticket
+from phones import phone_search_cache
+from audit import audit_log
+from analytics import rollups
+
+# Admission settings (override via environment)
+BOOKING_QUEUE_SIZE = int(os.getenv("BOOKING_QUEUE_SIZE", "50"))        # per trip, processed directly
+BOOKING_BATCH_SIZE = int(os.getenv("BOOKING_BATCH_SIZE", "20"))        # bookings per transaction
+BOOKING_BATCH_WAIT = float(os.getenv("BOOKING_BATCH_WAIT", "0.01"))    # linger to fill a batch
+BOOKING_TIMEOUT = float(os.getenv("BOOKING_TIMEOUT", "10.0"))
+WAITING_ROOM_SIZE = int(os.getenv("WAITING_ROOM_SIZE", "2000"))        # per trip
+WAITING_RESULT_TTL = float(os.getenv("WAITING_RESULT_TTL", "600"))
+WRITER_IDLE_TIMEOUT = float(os.getenv("WRITER_IDLE_TIMEOUT", "30"))
+SHED_QUEUE_DEPTH = int(os.getenv("SHED_QUEUE_DEPTH", "10000"))         # all trips, queue + waiting room
+SHED_LATENCY = float(os.getenv("SHED_LATENCY", "2.0"))                 # seconds, EWMA
+SHED_RETRY_AFTER = int(os.getenv("SHED_RETRY_AFTER", "30"))
+SHED_LATENCY_WINDOW = 10.0  # latency samples older than this do not trigger shedding
+
+# Ticket numbers are unique across all trips, so lane writers running in
+# different threads pick and insert them one at a time
+ticket_number_lock = threading.Lock()
+
+# Paths that keep working while the service sheds load
+SHED_EXEMPT_PREFIXES = ("/static", "/dispatcher", "/waiting-room", "/payments/webhook")
+
+
+class BookingError(Exception):
+    """Booking rejected, the message is shown to the passenger."""
+
+
+class Overloaded(Exception):
+    """Neither the queue nor the waiting room can take the request."""
+
+    def __init__(self, retry_after: int = SHED_RETRY_AFTER):
+        super().__init__("Сервис перегружен")
+        self.retry_after = retry_after
+
+
+@dataclass(eq=False)
+class BookingRequest:
+    trip_id: int
+    passenger_name: str
+    passenger_phone: str
+    boarding_point: str
+    passenger_phone_normalized: Optional[str] = None
+    token: str = field(default_factory=lambda: secrets.token_urlsafe(16))
+    created_at: float = field(default_factory=time.monotonic)
+    queued_at: Optional[float] = None  # entered the lane queue (after any waiting room)
+    future: Optional[asyncio.Future] = None
+    ticket_id: Optional[int] = None
+    error: Optional[str] = None
+    finished_at: Optional[float] = None
+
+    @property
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+
+class Ewma:
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        self.value: Optional[float] = None
+
+    def add(self, sample: float):
+        self.value = sample if self.value is None else self.alpha * sample + (1 - self.alpha) * self.value
+
+
+class TripLane:
+    """Bounded queue of bookings for one trip plus its overflow waiting room."""
+
+    def __init__(self, trip_id: int):
+        self.trip_id = trip_id
+        self.queue: Deque[BookingRequest] = deque()
+        self.waiting: Deque[BookingRequest] = deque()
+        self.wakeup = asyncio.Event()
+        self.writer: Optional[asyncio.Task] = None
+        self.throughput = Ewma()  # bookings per second
+
+    def admit_waiting(self, queue_size: int):
+        while self.waiting and len(self.queue) < queue_size:
+            request = self.waiting.popleft()
+            request.queued_at = time.monotonic()
+            self.queue.append(request)
+
+
+class AdmissionController:
+    """Serialises bookings per trip through a single writer coroutine.
+
+    Each writer drains its lane in batches and commits every batch in one
+    transaction, so concurrent passengers do not contend on the same `Trip`
+    row or on SQLite's single writer. Overflow goes to a token-based waiting
+    room, and when the total backlog or booking latency is too high new
+    requests are shed.
+    """
+
+    def __init__(self, session_factory: sessionmaker = SessionLocal,
+                 queue_size: int = BOOKING_QUEUE_SIZE, batch_size: int = BOOKING_BATCH_SIZE,
+                 batch_wait: float = BOOKING_BATCH_WAIT, waiting_room_size: int = WAITING_ROOM_SIZE,
+                 shed_queue_depth: int = SHED_QUEUE_DEPTH, shed_latency: float = SHED_LATENCY):
+        self.session_factory = session_factory
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.waiting_room_size = waiting_room_size
+        self.shed_queue_depth = shed_queue_depth
+        self.shed_latency = shed_latency
+
+        self.lanes: Dict[int, TripLane] = {}
+        self.tokens: Dict[str, BookingRequest] = {}
+        # Seconds from entering the lane queue to commit. Time parked in the
+        # waiting room is left out: it is long by design during a surge and
+        # would keep the service shedding after the lanes have drained.
+        self.latency = Ewma()
+        self.latency_updated_at = 0.0
+        self.inflight = 0
+        self.stats: Dict[str, int] = {"booked": 0, "rejected": 0, "waiting": 0, "shed": 0, "batches": 0}
+
+    # Load shedding
+
+    @property
+    def depth(self) -> int:
+        return sum(len(lane.queue) + len(lane.waiting) for lane in self.lanes.values())
+
+    def overloaded(self) -> bool:
+        if self.depth >= self.shed_queue_depth:
+            return True
+        if time.monotonic() - self.latency_updated_at > SHED_LATENCY_WINDOW:
+            return False
+        return self.latency.value is not None and self.latency.value > self.shed_latency
+
+    def record_latency(self, seconds: float):
+        self.latency.add(seconds)
+        self.latency_updated_at = time.monotonic()
+
+    async def stop(self, timeout: float = BOOKING_TIMEOUT):
+        """Let the writers drain their lanes, then cancel them."""
+        deadline = time.monotonic() + timeout
+        while (self.depth or self.inflight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        writers = [lane.writer for lane in self.lanes.values() if lane.writer is not None]
+        for writer in writers:
+            writer.cancel()
+        await asyncio.gather(*writers, return_exceptions=True)
+        self.lanes.clear()
+
+    # Submission
+
+    def submit(self, request: BookingRequest) -> BookingRequest:
+        """Put a booking into its trip lane.
+
+        Returns the request; `request.future` is set when it was admitted
+        directly, otherwise the request sits in the waiting room under
+        `request.token`. Raises Overloaded when it cannot be accepted.
+        """
+        self._purge_tokens()
+        if self.overloaded():
+            self.stats["shed"] += 1
+            raise Overloaded()
+
+        lane = self.lanes.get(request.trip_id)
+        if lane is None:
+            lane = self.lanes[request.trip_id] = TripLane(request.trip_id)
+
+        if len(lane.queue) < self.queue_size and not lane.waiting:
+            request.future = asyncio.get_running_loop().create_future()
+            request.queued_at = time.monotonic()
+            lane.queue.append(request)
+        elif len(lane.waiting) < self.waiting_room_size:
+            lane.waiting.append(request)
+            self.tokens[request.token] = request
+            self.stats["waiting"] += 1
+        else:
+            self.stats["shed"] += 1
+            raise Overloaded()
+
+        lane.wakeup.set()
+        if lane.writer is None or lane.writer.done():
+            lane.writer = asyncio.create_task(self._writer(lane))
+        return request
+
+    async def book(self, request: BookingRequest, timeout: float = BOOKING_TIMEOUT) -> BookingRequest:
+        """Submit and wait for the result if the request was admitted directly.
+
+        A request still pending after `timeout` is handed a waiting-room
+        token like an overflow request, so the passenger can keep polling.
+        """
+        self.submit(request)
+        if request.future is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(request.future), timeout=timeout)
+            except asyncio.TimeoutError:
+                # Nobody awaits the future any more; the result is read
+                # through the token, so drop it before _finish can set it
+                request.future = None
+                self.tokens[request.token] = request
+            except BookingError:
+                pass
+        return request
+
+    def position(self, token: str) -> Optional[dict]:
+        request = self.tokens.get(token)
+        if request is None:
+            return None
+        if request.done:
+            return {"status": "done" if request.ticket_id else "failed",
+                    "ticket_id": request.ticket_id, "error": request.error}
+
+        lane = self.lanes[request.trip_id]
+        if request in lane.waiting:
+            ahead = len(lane.queue) + lane.waiting.index(request)
+            status = "waiting"
+        else:
+            # Already admitted into the writer's queue or being committed
+            ahead = lane.queue.index(request) if request in lane.queue else 0
+            status = "processing"
+        rate = lane.throughput.value
+        eta = int(ahead / rate) + 1 if rate else None
+        return {"status": status, "position": ahead + 1, "eta_seconds": eta}
+
+    def _purge_tokens(self):
+        now = time.monotonic()
+        expired = [token for token, r in self.tokens.items()
+                   if r.done and now - r.finished_at > WAITING_RESULT_TTL]
+        for token in expired:
+            del self.tokens[token]
+
+    # Writer
+
+    async def _writer(self, lane: TripLane):
+        while True:
+            if not lane.queue:
+                lane.admit_waiting(self.queue_size)
+            if not lane.queue:
+                lane.wakeup.clear()
+                try:
+                    await asyncio.wait_for(lane.wakeup.wait(), timeout=WRITER_IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    if not lane.queue and not lane.waiting:
+                        del self.lanes[lane.trip_id]
+                        return
+                continue
+
+            if len(lane.queue) < self.batch_size and self.batch_wait:
+                await asyncio.sleep(self.batch_wait)
+            batch = [lane.queue.popleft() for _ in range(min(self.batch_size, len(lane.queue)))]
+
+            started = time.monotonic()
+            self.inflight += len(batch)
+            try:
+                results = await asyncio.to_thread(self._commit_batch, lane.trip_id, batch)
+            except Exception:
+                results = [BookingError("Ошибка при создании билета")] * len(batch)
+            finally:
+                self.inflight -= len(batch)
+            finished = time.monotonic()
+
+            self.stats["batches"] += 1
+            if finished > started:
+                lane.throughput.add(len(batch) / (finished - started))
+            for request, result in zip(batch, results):
+                self._finish(request, result, finished)
+            lane.admit_waiting(self.queue_size)
+
+    def _finish(self, request: BookingRequest, result, finished: float):
+        request.finished_at = finished
+        self.record_latency(finished - (request.queued_at or request.created_at))
+        if isinstance(result, Exception):
+            request.error = str(result)
+            self.stats["rejected"] += 1
+            if request.future is not None and not request.future.done():
+                request.future.set_exception(result)
+        else:
+            request.ticket_id = result
+            self.stats["booked"] += 1
+            if request.future is not None and not request.future.done():
+                request.future.set_result(result)
+
+    def _commit_batch(self, trip_id: int, batch: List[BookingRequest]) -> list:
+        with ticket_number_lock:
+            return self._commit_batch_locked(trip_id, batch)
+
+    def _commit_batch_locked(self, trip_id: int, batch: List[BookingRequest]) -> list:
+        db = self.session_factory()
+        try:
+            trip = db.query(Trip).filter(Trip.id == trip_id, Trip.is_active == 1).with_for_update().first()
+            if not trip:
+                return [BookingError("Рейс не найден")] * len(batch)
+
+            seats = max(0, trip.available_seats)
+            numbers = generate_ticket_numbers(db, min(seats, len(batch)))
+
+            results: list = []
+            tickets = []
+            for request in batch:
+                if not numbers:
+                    results.append(BookingError(
+                        "Нет доступных мест на этот рейс" if seats <= len(tickets)
+                        else "Нет свободных номеров билетов"
+                    ))
+                    continue
+                ticket = Ticket(
+                    ticket_number=numbers.pop(0),
+                    trip_id=trip_id,
+                    passenger_name=request.passenger_name,
+                    passenger_phone=request.passenger_phone,
+                    passenger_phone_normalized=request.passenger_phone_normalized,
+                    boarding_point=request.boarding_point,
+                    payment_status="unpaid",
+                    payment_amount=trip.price
+                )
+                db.add(ticket)
+                tickets.append(ticket)
+                results.append(ticket)
+
+            # Decrement in SQL so a concurrent trip edit is not overwritten
+            trip.available_seats = Trip.available_seats - len(tickets)
+            db.commit()
+            if tickets:
+                rollups.mark_dirty(trip.departure_date)
+            for ticket in tickets:
+                phone_search_cache.invalidate(ticket.passenger_phone_normalized)
+                audit_log.record("ticket.create", trip_id=trip_id, ticket_id=ticket.id,
+                                 ticket_number=ticket.ticket_number)
+            return [r if isinstance(r, Exception) else r.id for r in results]
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+
+def generate_ticket_numbers(db: Session, count: int) -> List[str]:
+    """Free ticket numbers 001-999, fewer than `count` if they run out."""
+    if count <= 0:
+        return []
+    existing = set(n[0] for n in db.query(Ticket.ticket_number).all())
+    numbers = []
+    for num in range(1, 1000):
+        candidate = f"{num:03d}"
+        if candidate not in existing:
+            numbers.append(candidate)
+            if len(numbers) == count:
+                break
+    return numbers
+
+
+class LoadSheddingMiddleware:
+    """Answers 503 with Retry-After while the admission controller is overloaded."""
+
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] == "http"
+                and not scope["path"].startswith(SHED_EXEMPT_PREFIXES)
+                and not scope["path"].endswith("/payment-status")
+                and self.controller.overloaded()):
+            self.controller.stats["shed"] += 1
+            response = PlainTextResponse(
+                "Сервис перегружен, попробуйте позже",
+                status_code=503,
+                headers={"Retry-After": str(SHED_RETRY_AFTER)}
+            )
+            await response(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+
+admission = AdmissionController()
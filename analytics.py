@@ -0,0 +1,264 @@
+import asyncio
+import logging
+import os
+import threading
+from datetime import date, timedelta
+from typing import Iterable, List, Optional, Set
+
+from sqlalchemy import Integer, cast, delete, func, insert, select, union
+from sqlalchemy.engine import Engine
+
+from database import engine
+from models import RouteDailyStats, Ticket, Trip
+
+logger = logging.getLogger(__name__)
+
+# Analytics settings (override via environment)
+ROLLUP_INTERVAL = float(os.getenv("ROLLUP_INTERVAL", "5.0"))       # seconds between refreshes
+ROLLUP_STARTUP_DAYS = int(os.getenv("ROLLUP_STARTUP_DAYS", "7"))   # past days re-rolled on start
+ROLLUP_CHUNK_DAYS = 200                                            # days per refresh statement
+
+FRAME_COLUMNS = ["day", "departure_city", "arrival_city", "hour", "trips",
+                 "seats_total", "seats_sold", "tickets_paid", "revenue"]
+
+WEEKDAYS = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+
+
+def _rollup_select(days: List[date]):
+    """Aggregates of active trips on `days` and their paid tickets,
+    grouped by day, route and departure hour."""
+    paid = (
+        select(
+            Ticket.trip_id.label("trip_id"),
+            func.count(Ticket.id).label("tickets_paid"),
+            func.sum(Ticket.payment_amount).label("revenue"),
+        )
+        .join(Trip, Trip.id == Ticket.trip_id)
+        .where(Trip.departure_date.in_(days), Ticket.payment_status == "paid")
+        .group_by(Ticket.trip_id)
+        .subquery()
+    )
+    hour = cast(func.substr(Trip.departure_time, 1, 2), Integer)
+    return (
+        select(
+            Trip.departure_date,
+            Trip.departure_city,
+            Trip.arrival_city,
+            hour,
+            func.count(Trip.id),
+            func.sum(Trip.total_seats),
+            func.sum(Trip.total_seats - Trip.available_seats),
+            func.coalesce(func.sum(paid.c.tickets_paid), 0),
+            func.coalesce(func.sum(paid.c.revenue), 0.0),
+        )
+        .outerjoin(paid, paid.c.trip_id == Trip.id)
+        .where(Trip.departure_date.in_(days), Trip.is_active == 1)
+        .group_by(Trip.departure_date, Trip.departure_city, Trip.arrival_city, hour)
+    )
+
+
+class RollupMaintainer:
+    """Keeps `route_daily_stats` up to date and serves reports from it.
+
+    Write paths mark the departure days they touched with `mark_dirty`; a
+    background task re-aggregates only those days. Reports run on an
+    in-memory columnar copy of the rollup table (a pandas DataFrame) that
+    is loaded once and patched per refreshed day, so they never touch
+    `tickets` or `trips`.
+    """
+
+    def __init__(self, bind: Engine = engine, interval: float = ROLLUP_INTERVAL):
+        self.bind = bind
+        self.interval = interval
+        self._dirty: Set[date] = set()
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._frame = None
+        self._task: Optional[asyncio.Task] = None
+
+    def mark_dirty(self, *days: Optional[date]):
+        with self._lock:
+            self._dirty.update(d for d in days if d is not None)
+
+    async def start(self):
+        await asyncio.to_thread(self.catch_up)
+        self._task = asyncio.create_task(self._refresher())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await asyncio.to_thread(self.refresh_pending)
+
+    async def _refresher(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(self.refresh_pending)
+            except Exception:
+                logger.exception("Failed to refresh analytics rollups")
+
+    # Maintenance
+
+    def refresh_pending(self):
+        with self._lock:
+            days, self._dirty = self._dirty, set()
+        if not days:
+            return
+        try:
+            self.refresh_days(days)
+        except Exception:
+            self.mark_dirty(*days)
+            raise
+
+    def refresh_days(self, days: Iterable[date]):
+        days = sorted(set(days))
+        with self._refresh_lock:
+            for start in range(0, len(days), ROLLUP_CHUNK_DAYS):
+                chunk = days[start:start + ROLLUP_CHUNK_DAYS]
+                with self.bind.begin() as conn:
+                    conn.execute(delete(RouteDailyStats).where(RouteDailyStats.day.in_(chunk)))
+                    conn.execute(insert(RouteDailyStats).from_select(FRAME_COLUMNS, _rollup_select(chunk)))
+                self._patch_frame(chunk)
+
+    def refresh_since(self, start: date):
+        """Re-roll every day from `start` that has trips or stale rollup rows."""
+        query = union(
+            select(Trip.departure_date).where(Trip.departure_date >= start),
+            select(RouteDailyStats.day).where(RouteDailyStats.day >= start),
+        )
+        with self.bind.connect() as conn:
+            days = [row[0] for row in conn.execute(query)]
+        self.refresh_days(days)
+
+    def catch_up(self):
+        # Dirty marks live in memory, so days touched before a restart are
+        # re-rolled from a recent window; an empty table is built in full
+        with self.bind.connect() as conn:
+            empty = conn.execute(select(RouteDailyStats.id).limit(1)).first() is None
+        if empty:
+            self.rebuild()
+        else:
+            self.refresh_since(date.today() - timedelta(days=ROLLUP_STARTUP_DAYS))
+        # Load the columnar copy now so the first report does not pay for it
+        self.frame()
+
+    def rebuild(self):
+        """Recompute the whole rollup table from scratch."""
+        with self.bind.begin() as conn:
+            conn.execute(delete(RouteDailyStats))
+            days = [row[0] for row in conn.execute(select(Trip.departure_date).distinct())]
+        self._frame = None
+        self.refresh_days(days)
+
+    # Columnar extract
+
+    def _read_frame(self, days: Optional[List[date]] = None):
+        import pandas as pd
+
+        query = select(*[getattr(RouteDailyStats, c) for c in FRAME_COLUMNS])
+        if days is not None:
+            query = query.where(RouteDailyStats.day.in_(days))
+        with self.bind.connect() as conn:
+            rows = conn.execute(query).fetchall()
+        frame = pd.DataFrame.from_records(rows, columns=FRAME_COLUMNS)
+        day = pd.to_datetime(frame.pop("day"))
+        route = frame.pop("departure_city") + " → " + frame.pop("arrival_city")
+        # Grouping keys are stored as small integers / categories so the
+        # reports group on fixed-width columns instead of Python strings
+        return frame.assign(
+            day=day,
+            weekday=day.dt.weekday.astype("int8"),
+            month=(day.dt.year * 12 + day.dt.month - 1).astype("int32"),
+            route=route.astype("category"),
+            hour=frame["hour"].astype("int8"),
+        )
+
+    def _patch_frame(self, days: List[date]):
+        if self._frame is None:
+            return
+        import pandas as pd
+
+        fresh = self._read_frame(days)
+        frame = self._frame
+        keep = ~frame["day"].isin(pd.to_datetime(days))
+        merged = pd.concat([frame[keep], fresh], ignore_index=True)
+        merged["route"] = merged["route"].astype("category")
+        self._frame = merged
+
+    def frame(self):
+        if self._frame is None:
+            with self._refresh_lock:
+                if self._frame is None:
+                    self._frame = self._read_frame()
+        return self._frame
+
+    # Reports
+
+    def report(self, date_from: date, date_to: date, route: Optional[str] = None) -> dict:
+        """Load factor by route, weekday and hour plus monthly revenue for a period."""
+        import numpy as np
+        import pandas as pd
+
+        frame = self.frame()
+        mask = (frame["day"] >= pd.Timestamp(date_from)) & (frame["day"] <= pd.Timestamp(date_to))
+        routes = sorted(frame.loc[mask, "route"].unique().tolist())
+        if route:
+            mask &= frame["route"] == route
+        period = frame.loc[mask, ["route", "weekday", "hour", "month", "trips",
+                                  "seats_total", "seats_sold", "tickets_paid", "revenue"]]
+
+        def load_factor(key):
+            totals = period.groupby(key, observed=True)[["seats_sold", "seats_total", "revenue"]].sum()
+            seats = totals["seats_total"].replace(0, np.nan)
+            totals["load_factor"] = (totals["seats_sold"] / seats).fillna(0.0)
+            return totals
+
+        by_route = load_factor("route").sort_values("load_factor", ascending=False)
+        by_weekday = load_factor("weekday").reindex(range(7), fill_value=0)
+        by_hour = load_factor("hour").sort_index()
+        by_month = load_factor("month").sort_index()
+
+        seats_total = int(period["seats_total"].sum())
+        return {
+            "date_from": date_from.isoformat(),
+            "date_to": date_to.isoformat(),
+            "route": route,
+            "routes": routes,
+            "totals": {
+                "trips": int(period["trips"].sum()),
+                "tickets_paid": int(period["tickets_paid"].sum()),
+                "revenue": round(float(period["revenue"].sum()), 2),
+                "load_factor": round(float(period["seats_sold"].sum()) / seats_total, 4) if seats_total else 0.0,
+            },
+            "by_route": {
+                "labels": by_route.index.tolist(),
+                "load_factor": by_route["load_factor"].round(4).tolist(),
+                "revenue": by_route["revenue"].round(2).tolist(),
+            },
+            "by_weekday": {
+                "labels": WEEKDAYS,
+                "load_factor": by_weekday["load_factor"].round(4).tolist(),
+            },
+            "by_hour": {
+                "labels": [f"{int(h):02d}:00" for h in by_hour.index],
+                "load_factor": by_hour["load_factor"].round(4).tolist(),
+            },
+            "by_month": {
+                "labels": [f"{m // 12}-{m % 12 + 1:02d}" for m in by_month.index],
+                "revenue": by_month["revenue"].round(2).tolist(),
+                "load_factor": by_month["load_factor"].round(4).tolist(),
+            },
+        }
+
+
+rollups = RollupMaintainer()
+
+
+if __name__ == "__main__":
+    from migrate import migrate
+
+    migrate()
+    rollups.rebuild()
+    print("Analytics rollups rebuilt")
@@ -0,0 +1,223 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import tempfile
+from typing import Dict, Optional
+
+from fastapi.staticfiles import StaticFiles
+from starlette.staticfiles import NotModifiedResponse
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware, GZipResponder
+from starlette.responses import FileResponse, Response
+
+STATIC_DIR = "static"
+BUILD_DIR = os.path.join(STATIC_DIR, "build")
+STATIC_URL = "/static"
+MANIFEST_NAME = "manifest.json"  # not fingerprinted, so never served as immutable
+
+COMPRESSIBLE_EXTENSIONS = {".css", ".js", ".svg", ".json", ".txt", ".html", ".map"}
+# Dynamic responses worth gzipping; XLSX (zip) and Parquet exports are compressed already
+COMPRESSIBLE_MEDIA_TYPES = {"application/json", "application/javascript", "application/xml", "image/svg+xml"}
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+STATIC_CACHE_CONTROL = "public, max-age=3600"
+
+# Preferred first
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+_manifest: Optional[Dict[str, str]] = None
+
+
+def _file_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()[:12]
+
+
+def _source_files(static_dir: str, build_dir: str):
+    build_dir = os.path.abspath(build_dir)
+    for root, dirs, files in os.walk(static_dir):
+        if os.path.abspath(root) == build_dir:
+            dirs[:] = []
+            continue
+        dirs[:] = [d for d in dirs if os.path.abspath(os.path.join(root, d)) != build_dir]
+        for name in files:
+            path = os.path.join(root, name)
+            yield os.path.relpath(path, static_dir).replace(os.sep, "/"), path
+
+
+def _write_atomic(path: str, data: bytes):
+    """Write to a temp file next to `path` and rename it into place, so
+    another worker never serves a half-written file."""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def _precompress(path: str, data: bytes):
+    # mtime=0 keeps the output reproducible between builds
+    _write_atomic(path + ".gz", gzip.compress(data, compresslevel=9, mtime=0))
+    try:
+        import brotli
+    except ImportError:
+        return
+    _write_atomic(path + ".br", brotli.compress(data, quality=11))
+
+
+def build_assets(static_dir: str = STATIC_DIR, build_dir: str = BUILD_DIR) -> Dict[str, str]:
+    """Copy static files to build_dir under content-hashed names, write gzip
+    and brotli variants next to them and save the name manifest."""
+    manifest = {}
+    for rel_path, path in _source_files(static_dir, build_dir):
+        stem, ext = os.path.splitext(rel_path)
+        hashed = f"{stem}.{_file_hash(path)}{ext}"
+        target = os.path.join(build_dir, hashed)
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(path, "rb") as f:
+                data = f.read()
+            # Variants first: once the hashed file exists the build skips it
+            if ext.lower() in COMPRESSIBLE_EXTENSIONS:
+                _precompress(target, data)
+            _write_atomic(target, data)
+        manifest[rel_path] = hashed
+
+    os.makedirs(build_dir, exist_ok=True)
+    _write_atomic(os.path.join(build_dir, MANIFEST_NAME),
+                  json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8"))
+    return manifest
+
+
+def _manifest_is_stale(static_dir: str, build_dir: str, manifest_path: str) -> bool:
+    if not os.path.exists(manifest_path):
+        return True
+    built_at = os.path.getmtime(manifest_path)
+    return any(os.path.getmtime(path) > built_at for _, path in _source_files(static_dir, build_dir))
+
+
+def load_manifest(static_dir: str = STATIC_DIR, build_dir: str = BUILD_DIR) -> Dict[str, str]:
+    """Load the manifest, building the assets first if they are missing or
+    stale. Called at startup, never while rendering a request."""
+    global _manifest
+    manifest_path = os.path.join(build_dir, MANIFEST_NAME)
+    if _manifest_is_stale(static_dir, build_dir, manifest_path):
+        _manifest = build_assets(static_dir, build_dir)
+    else:
+        with open(manifest_path, encoding="utf-8") as f:
+            _manifest = json.load(f)
+    return _manifest
+
+
+def asset_url(path: str) -> str:
+    """Template helper: URL of the fingerprinted copy of a static file,
+    or of the original file until the manifest has been loaded."""
+    hashed = (_manifest or {}).get(path)
+    if hashed is None:
+        return f"{STATIC_URL}/{path}"
+    return f"{STATIC_URL}/build/{hashed}"
+
+
+def accepted_encodings(header: str) -> set:
+    accepted = set()
+    for item in header.split(","):
+        parts = item.strip().split(";")
+        encoding = parts[0].strip().lower()
+        q = 1.0
+        for param in parts[1:]:
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if encoding and q > 0:
+            accepted.add(encoding)
+    return accepted
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles that serves .br/.gz siblings when the client accepts them
+    and marks fingerprinted files under build/ as immutable."""
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        full_path = str(full_path)
+        ext = os.path.splitext(full_path)[1].lower()
+
+        response = None
+        if ext in COMPRESSIBLE_EXTENSIONS:
+            accepted = accepted_encodings(request_headers.get("accept-encoding", ""))
+            for encoding, suffix in ENCODINGS:
+                if encoding not in accepted:
+                    continue
+                try:
+                    encoded_stat = os.stat(full_path + suffix)
+                except OSError:
+                    continue
+                response = FileResponse(
+                    full_path + suffix,
+                    status_code=status_code,
+                    stat_result=encoded_stat,
+                    method=scope["method"],
+                    media_type=mimetypes.guess_type(full_path)[0] or "text/plain",
+                )
+                response.headers["Content-Encoding"] = encoding
+                break
+
+        if response is None:
+            response = FileResponse(full_path, status_code=status_code, stat_result=stat_result,
+                                    method=scope["method"])
+        if ext in COMPRESSIBLE_EXTENSIONS:
+            response.headers.setdefault("Vary", "Accept-Encoding")
+
+        build_dir = os.path.realpath(os.path.join(str(self.directory), "build"))
+        if (os.path.commonpath([os.path.realpath(full_path), build_dir]) == build_dir
+                and os.path.basename(full_path) != MANIFEST_NAME):
+            response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        else:
+            response.headers["Cache-Control"] = STATIC_CACHE_CONTROL
+
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+def is_compressible(content_type: str) -> bool:
+    media_type = content_type.split(";")[0].strip().lower()
+    return media_type.startswith("text/") or media_type in COMPRESSIBLE_MEDIA_TYPES
+
+
+class _TextGZipResponder(GZipResponder):
+    async def send_with_gzip(self, message):
+        if message["type"] == "http.response.start":
+            await super().send_with_gzip(message)
+            # Treat other media types like an already encoded body: pass through
+            if not is_compressible(Headers(raw=message["headers"]).get("content-type", "")):
+                self.content_encoding_set = True
+            return
+        await super().send_with_gzip(message)
+
+
+class TextGZipMiddleware(GZipMiddleware):
+    """GZipMiddleware that only compresses text/* and JSON-like responses."""
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and "gzip" in Headers(scope=scope).get("Accept-Encoding", ""):
+            responder = _TextGZipResponder(self.app, self.minimum_size, compresslevel=self.compresslevel)
+            await responder(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+
+if __name__ == "__main__":
+    built = build_assets()
+    for source, hashed in built.items():
+        print(f"{source} -> build/{hashed}")
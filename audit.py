@@ -0,0 +1,149 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from database import engine as main_engine
+from models import AuditEvent
+
+logger = logging.getLogger(__name__)
+
+# Audit settings (override via environment)
+AUDIT_DATABASE_URL = os.getenv("AUDIT_DATABASE_URL")       # separate SQLite file, optional
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "1.0"))  # seconds, 0 = flush every event
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+AUDIT_PAGE_SIZE = 50
+
+
+def _audit_engine() -> Engine:
+    if not AUDIT_DATABASE_URL:
+        return main_engine
+    return create_engine(
+        AUDIT_DATABASE_URL,
+        connect_args={"check_same_thread": False} if "sqlite" in AUDIT_DATABASE_URL else {}
+    )
+
+
+class AuditLog:
+    """Append-only event log with write-behind batching.
+
+    `record` only appends to an in-memory buffer; a background flusher
+    writes the buffer with one multi-row INSERT every `flush_interval`
+    seconds, or as soon as `batch_size` events are pending. Events still
+    buffered when the process dies are lost, so the flush interval is
+    the durability window.
+    """
+
+    def __init__(self, bind: Optional[Engine] = None, flush_interval: float = AUDIT_FLUSH_INTERVAL,
+                 batch_size: int = AUDIT_BATCH_SIZE):
+        self.bind = bind
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+        self._buffer: List[dict] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # keeps flushed batches in order
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"recorded": 0, "written": 0, "flushes": 0}
+
+    def record(self, event_type: str, dispatcher=None, trip_id: Optional[int] = None,
+               ticket_id: Optional[int] = None, **data):
+        """Queue an event. Safe to call from the event loop or worker threads."""
+        event = {
+            "created_at": datetime.now(timezone.utc),
+            "event_type": event_type,
+            "dispatcher_id": getattr(dispatcher, "id", dispatcher),
+            "trip_id": trip_id,
+            "ticket_id": ticket_id,
+            "data": json.dumps(data, ensure_ascii=False, default=str) if data else None,
+        }
+        with self._lock:
+            self._buffer.append(event)
+            self.stats["recorded"] += 1
+            pending = len(self._buffer)
+
+        if self._loop is not None and (pending >= self.batch_size or self.flush_interval <= 0):
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def get_bind(self) -> Engine:
+        if self.bind is None:
+            self.bind = _audit_engine()
+        return self.bind
+
+    async def start(self):
+        if self.get_bind() is not main_engine:
+            await asyncio.to_thread(AuditEvent.__table__.create, self.bind, checkfirst=True)
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._flusher())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self._loop = None
+        await asyncio.to_thread(self.flush)
+
+    async def _flusher(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval or None)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception:
+                logger.exception("Failed to flush audit events")
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                batch, self._buffer = self._buffer, []
+            if not batch:
+                return
+            written = 0
+            try:
+                while written < len(batch):
+                    chunk = batch[written:written + self.batch_size]
+                    with self.get_bind().begin() as conn:
+                        conn.execute(insert(AuditEvent), chunk)
+                    written += len(chunk)
+            except Exception:
+                # Put unwritten events back in front so the next flush retries them
+                with self._lock:
+                    self._buffer[:0] = batch[written:]
+                raise
+            finally:
+                self.stats["written"] += written
+            self.stats["flushes"] += 1
+
+    def query(self, trip_id: Optional[int] = None, ticket_id: Optional[int] = None,
+              dispatcher_id: Optional[int] = None, before_id: Optional[int] = None,
+              limit: int = AUDIT_PAGE_SIZE) -> List[AuditEvent]:
+        """Newest events first; the next page starts below `before_id`."""
+        self.flush()
+        with Session(bind=self.get_bind()) as db:
+            query = db.query(AuditEvent)
+            if trip_id is not None:
+                query = query.filter(AuditEvent.trip_id == trip_id)
+            if ticket_id is not None:
+                query = query.filter(AuditEvent.ticket_id == ticket_id)
+            if dispatcher_id is not None:
+                query = query.filter(AuditEvent.dispatcher_id == dispatcher_id)
+            if before_id is not None:
+                query = query.filter(AuditEvent.id < before_id)
+            return query.order_by(AuditEvent.id.desc()).limit(limit).all()
+
+
+audit_log = AuditLog()
@@ -0,0 +1,279 @@
+import argparse
+import asyncio
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from database import engine
+
+logger = logging.getLogger(__name__)
+
+# Backup settings (override via environment)
+BACKUP_DIR = os.getenv("BACKUP_DIR", "./backups")
+BACKUP_INTERVAL = float(os.getenv("BACKUP_INTERVAL", "86400"))   # seconds between snapshots, 0 = off
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))                 # snapshots kept
+BACKUP_COMPRESS = os.getenv("BACKUP_COMPRESS", "1") == "1"       # gzip snapshots
+BACKUP_PAGES = int(os.getenv("BACKUP_PAGES", "256"))             # pages copied per step
+BACKUP_SLEEP = float(os.getenv("BACKUP_SLEEP", "0.05"))          # pause between steps, seconds
+BACKUP_MAX_RESTARTS = int(os.getenv("BACKUP_MAX_RESTARTS", "3"))
+
+SNAPSHOT_PREFIX = "bus_schedule-"
+
+
+class BackupError(Exception):
+    pass
+
+
+class _Restarted(Exception):
+    pass
+
+
+def database_path() -> Path:
+    """File of the live database; backups are only supported for SQLite."""
+    if engine.url.get_backend_name() != "sqlite" or engine.url.database in (None, "", ":memory:"):
+        raise BackupError("Резервное копирование поддерживается только для файла SQLite")
+    return Path(engine.url.database)
+
+
+def online_backup(source: Path, target: Path, pages: int = BACKUP_PAGES, step_sleep: float = BACKUP_SLEEP,
+                  max_restarts: int = BACKUP_MAX_RESTARTS) -> Dict[str, int]:
+    """Copy a live SQLite database with the online backup API.
+
+    Pages are copied `pages` at a time with a `step_sleep` pause between
+    steps. In WAL mode the copy runs inside one read transaction on the
+    source: it sees a fixed snapshot and booking writers keep committing
+    to the log meanwhile. With a rollback journal the source is unlocked
+    between steps instead, and every write makes SQLite restart the copy;
+    after `max_restarts` restarts the rest is copied in a single step.
+    The copy is switched to a rollback journal so it is one self-contained file.
+    """
+    stats = {"steps": 0, "restarts": 0, "pages": 0}
+    last_remaining: Optional[int] = None
+
+    def progress(status, remaining, total):
+        nonlocal last_remaining
+        stats["steps"] += 1
+        stats["pages"] = total
+        if last_remaining is not None and remaining > last_remaining:
+            stats["restarts"] += 1
+            if stats["restarts"] > max_restarts:
+                raise _Restarted()
+        last_remaining = remaining
+        if remaining and step_sleep > 0:
+            time.sleep(step_sleep)
+
+    src = sqlite3.connect(str(source), timeout=30, isolation_level=None)
+    dst = sqlite3.connect(str(target))
+    try:
+        wal = src.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        if wal:
+            src.execute("BEGIN")
+            src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        try:
+            src.backup(dst, pages=pages, progress=progress)
+        except _Restarted:
+            logger.warning("Backup of %s restarted %d times, finishing in one step", source, stats["restarts"])
+            src.backup(dst, pages=-1)
+            stats["steps"] += 1
+        finally:
+            if wal:
+                src.execute("COMMIT")
+        dst.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        dst.close()
+        src.close()
+    return stats
+
+
+@contextmanager
+def opened_snapshot(path: Path):
+    """Path of a plain SQLite file for `path`, decompressing .gz snapshots to a temp file."""
+    if path.suffix != ".gz":
+        yield path
+        return
+    fd, tmp = tempfile.mkstemp(suffix=".db")
+    try:
+        with os.fdopen(fd, "wb") as out, gzip.open(path, "rb") as src:
+            shutil.copyfileobj(src, out, 1024 * 1024)
+        yield Path(tmp)
+    finally:
+        os.remove(tmp)
+
+
+def table_counts(path: Path) -> Dict[str, int]:
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        tables = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+        )]
+        return {t: conn.execute(f'SELECT COUNT(*) FROM "{t}"').fetchone()[0] for t in tables}
+    finally:
+        conn.close()
+
+
+def verify(path: Path) -> Dict[str, int]:
+    """Run PRAGMA integrity_check on a snapshot and return its row counts."""
+    with opened_snapshot(Path(path)) as db_path:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            result = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+        except sqlite3.DatabaseError as e:
+            raise BackupError(f"{path}: {e}")
+        finally:
+            conn.close()
+        if result != ["ok"]:
+            raise BackupError(f"{path}: " + "; ".join(result[:5]))
+        return table_counts(db_path)
+
+
+def list_snapshots(backup_dir: str = BACKUP_DIR) -> List[Path]:
+    """Snapshots oldest first (the timestamp in the name sorts chronologically)."""
+    directory = Path(backup_dir)
+    if not directory.is_dir():
+        return []
+    return sorted(p for p in directory.iterdir()
+                  if p.name.startswith(SNAPSHOT_PREFIX) and p.name.endswith((".db", ".db.gz")))
+
+
+def prune(backup_dir: str = BACKUP_DIR, keep: int = BACKUP_KEEP) -> List[Path]:
+    snapshots = list_snapshots(backup_dir)
+    removed = snapshots[:-keep] if keep > 0 else []
+    for path in removed:
+        path.unlink()
+    return removed
+
+
+def snapshot(backup_dir: str = BACKUP_DIR, compress: bool = BACKUP_COMPRESS, keep: int = BACKUP_KEEP) -> Path:
+    """Back up the live database into `backup_dir`, check it and apply retention."""
+    directory = Path(backup_dir)
+    directory.mkdir(parents=True, exist_ok=True)
+    name = f"{SNAPSHOT_PREFIX}{datetime.now().strftime('%Y%m%d-%H%M%S')}.db"
+    part = directory / (name + ".part")
+    gz_part = directory / (name + ".gz.part")
+
+    started = time.monotonic()
+    try:
+        stats = online_backup(database_path(), part)
+        verify(part)
+        if compress:
+            target = directory / (name + ".gz")
+            with open(part, "rb") as src, gzip.open(gz_part, "wb", compresslevel=6) as out:
+                shutil.copyfileobj(src, out, 1024 * 1024)
+            os.replace(gz_part, target)
+            part.unlink()
+        else:
+            target = directory / name
+            os.replace(part, target)
+    except Exception:
+        for leftover in (part, gz_part):
+            if leftover.exists():
+                leftover.unlink()
+        raise
+
+    logger.info("Snapshot %s: %d pages in %d steps (%d restarts), %.1f s", target.name, stats["pages"],
+                stats["steps"], stats["restarts"], time.monotonic() - started)
+    prune(backup_dir, keep)
+    return target
+
+
+def restore(path: Path, target: Optional[Path] = None) -> Dict[str, int]:
+    """Verify a snapshot and copy it over the live database.
+
+    The copy goes through the backup API, so connections that stay open
+    see the restored data; stopping the application first is still
+    recommended to avoid losing bookings made meanwhile.
+    """
+    target = target or database_path()
+    with opened_snapshot(Path(path)) as db_path:
+        expected = verify(db_path)
+        src = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        dst = sqlite3.connect(str(target), timeout=30)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close()
+            src.close()
+
+    actual = table_counts(target)
+    if actual != expected:
+        raise BackupError(f"Число строк после восстановления не совпадает: {actual} != {expected}")
+    return actual
+
+
+class BackupScheduler:
+    """Takes a snapshot every `interval` seconds in a worker thread."""
+
+    def __init__(self, interval: float = BACKUP_INTERVAL):
+        self.interval = interval
+        self.last_snapshot: Optional[Path] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.last_snapshot = await asyncio.to_thread(snapshot)
+            except Exception:
+                logger.exception("Scheduled backup failed")
+
+
+backup_scheduler = BackupScheduler()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Резервные копии bus_schedule.db")
+    commands = parser.add_subparsers(dest="command", required=True)
+    create = commands.add_parser("snapshot", help="сделать снимок работающей базы")
+    create.add_argument("--no-compress", action="store_true")
+    commands.add_parser("list", help="список снимков")
+    check = commands.add_parser("verify", help="проверить целостность снимка")
+    check.add_argument("path", nargs="?", help="по умолчанию последний снимок")
+    back = commands.add_parser("restore", help="восстановить базу из снимка")
+    back.add_argument("path")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        if args.command == "snapshot":
+            print(snapshot(compress=not args.no_compress))
+        elif args.command == "list":
+            for path in list_snapshots():
+                print(f"{path.name}  {path.stat().st_size / 1e6:.1f} MB")
+        elif args.command == "verify":
+            snapshots = list_snapshots()
+            if not args.path and not snapshots:
+                raise BackupError("Снимков нет")
+            path = Path(args.path) if args.path else snapshots[-1]
+            for table, count in verify(path).items():
+                print(f"{table}: {count}")
+            print(f"{path}: ok")
+        elif args.command == "restore":
+            for table, count in restore(Path(args.path)).items():
+                print(f"{table}: {count}")
+            print(f"Восстановлено из {args.path}")
+    except BackupError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
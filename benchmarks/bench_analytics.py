@@ -0,0 +1,95 @@
+"""Analytics report latency on years of synthetic rollups.
+
+Fills `route_daily_stats` directly (as the refresher would after years of
+operation), then times the first report (columnar extract + aggregation)
+and repeated reports on the cached frame.
+
+Usage: python benchmarks/bench_analytics.py [--years 1 3 5] [--routes 20]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+
+from models import Base
+from analytics import RollupMaintainer
+
+CITIES = ["Ижевск", "Глазов", "Сарапул", "Воткинск", "Можга", "Игра", "Ува", "Кез"]
+HOURS = [6, 8, 10, 12, 14, 16, 18, 20]
+
+
+def prepare_db(path: str, years: int, routes: int):
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    pairs = [(a, b) for a in CITIES for b in CITIES if a != b][:routes]
+    start = date.today() - timedelta(days=365 * years)
+    rng = random.Random(42)
+
+    def rows():
+        for offset in range(365 * years):
+            day = (start + timedelta(days=offset)).isoformat()
+            for departure, arrival in pairs:
+                for hour in HOURS:
+                    sold = rng.randint(0, 50)
+                    yield (day, departure, arrival, hour, 1, 50, sold, sold, sold * 200.0)
+
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO route_daily_stats (day, departure_city, arrival_city, hour, trips,"
+        " seats_total, seats_sold, tickets_paid, revenue) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        rows()
+    )
+    conn.commit()
+    count = conn.execute("SELECT COUNT(*) FROM route_daily_stats").fetchone()[0]
+    conn.close()
+    return engine, start, count
+
+
+def run(years: int, routes: int, repeats: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine, start, count = prepare_db(os.path.join(tmp, "bench.db"), years, routes)
+        rollups = RollupMaintainer(bind=engine)
+        end = date.today()
+
+        t0 = time.perf_counter()
+        rollups.report(start, end)
+        cold = (time.perf_counter() - t0) * 1000
+
+        warm = []
+        for i in range(repeats):
+            t0 = time.perf_counter()
+            rollups.report(start + timedelta(days=i), end)
+            warm.append((time.perf_counter() - t0) * 1000)
+
+        t0 = time.perf_counter()
+        rollups.refresh_days([end - timedelta(days=1)])
+        patch = (time.perf_counter() - t0) * 1000
+        engine.dispose()
+
+    print(f"years={years} rollup rows={count:>8d}: first report {cold:7.1f} ms, "
+          f"cached p50 {statistics.median(warm):6.1f} ms, max {max(warm):6.1f} ms, "
+          f"refresh+patch one day {patch:6.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--years", type=int, nargs="+", default=[1, 3])
+    parser.add_argument("--routes", type=int, default=20)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    for years in args.years:
+        run(years, args.routes, args.repeats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Booking commit latency while an online backup of the database runs.
+
+A writer thread books tickets (the same statements as the admission
+lane writer) at a steady rate, first with no backup, then during a paged
+backup (BACKUP_PAGES / BACKUP_SLEEP) and during a single-step copy.
+
+Usage: python benchmarks/bench_backup.py [--tickets 300000] [--pages 256] [--sleep 0.05] [--journal wal]
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models import Base, Trip, Ticket
+from backup import online_backup
+
+
+def prepare_db(path: str, tickets: int, journal: str) -> sessionmaker:
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    conn = sqlite3.connect(path)
+    conn.execute(f"PRAGMA journal_mode={journal}")
+    conn.execute(
+        "INSERT INTO trips (id, departure_city, arrival_city, departure_date, departure_time, arrival_time,"
+        " bus_number, bus_name, bus_color, total_seats, available_seats, price, is_active)"
+        " VALUES (1, 'Ижевск', 'Глазов', ?, '10:00', '11:45', 'У456ББ18', 'ЛИАЗ-5256', 'Красный', 1000000000,"
+        " 1000000000, 200.0, 1)",
+        (date.today().isoformat(),)
+    )
+    conn.executemany(
+        "INSERT INTO tickets (ticket_number, trip_id, passenger_name, passenger_phone, passenger_phone_normalized,"
+        " boarding_point, status, payment_status, payment_amount, is_open_date)"
+        " VALUES (?, 1, ?, ?, ?, ?, 'confirmed', 'paid', 200.0, 0)",
+        ((f"B{i:08d}", "Иванов Иван Иванович", "+7 (912) 000-00-00", "+79120000000", "Автовокзал Ижевск")
+         for i in range(tickets))
+    )
+    conn.commit()
+    conn.close()
+    return sessionmaker(bind=engine)
+
+
+def book(Session, number: int):
+    db = Session()
+    try:
+        trip = db.query(Trip).filter(Trip.id == 1, Trip.is_active == 1).with_for_update().first()
+        db.add(Ticket(ticket_number=f"N{number:08d}", trip_id=1, passenger_name="Петров Пётр",
+                      passenger_phone="89120000000", passenger_phone_normalized="+79120000000",
+                      boarding_point="Автовокзал", payment_status="unpaid", payment_amount=trip.price))
+        trip.available_seats -= 1
+        db.commit()
+    finally:
+        db.close()
+
+
+class Writer(threading.Thread):
+    def __init__(self, Session, interval: float):
+        super().__init__(daemon=True)
+        self.Session = Session
+        self.interval = interval
+        self.samples = []
+        self.errors = 0
+        self.running = True
+        self.number = 0
+
+    def run(self):
+        while self.running:
+            self.number += 1
+            started = time.perf_counter()
+            try:
+                book(self.Session, self.number)
+            except Exception:
+                self.errors += 1
+            self.samples.append((time.perf_counter() - started) * 1000)
+            time.sleep(self.interval)
+
+    def take(self):
+        samples, self.samples = self.samples, []
+        return samples
+
+
+def summary(label: str, samples, extra: str = ""):
+    if not samples:
+        print(f"{label:22s}: no bookings")
+        return
+    samples = sorted(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print(f"{label:22s}: {len(samples):5d} bookings, p50 {statistics.median(samples):6.2f} ms, "
+          f"p99 {p99:7.2f} ms, max {samples[-1]:7.2f} ms {extra}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tickets", type=int, default=300000)
+    parser.add_argument("--pages", type=int, default=256)
+    parser.add_argument("--sleep", type=float, default=0.05)
+    parser.add_argument("--journal", choices=["wal", "delete"], default="wal")
+    parser.add_argument("--interval", type=float, default=0.01, help="pause between bookings, seconds")
+    parser.add_argument("--baseline", type=float, default=3.0, help="seconds measured without backup")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "live.db")
+        Session = prepare_db(source, args.tickets, args.journal)
+        print(f"database {os.path.getsize(source) / 1e6:.1f} MB, journal_mode={args.journal}")
+
+        writer = Writer(Session, args.interval)
+        writer.start()
+        time.sleep(args.baseline)
+        summary("no backup", writer.take())
+
+        for label, pages, step_sleep in (("paged backup", args.pages, args.sleep), ("single-step backup", -1, 0)):
+            target = os.path.join(tmp, f"copy{pages}.db")
+            writer.take()
+            started = time.perf_counter()
+            stats = online_backup(source, target, pages=pages, step_sleep=step_sleep)
+            elapsed = time.perf_counter() - started
+            summary(label, writer.take(), f"(backup {elapsed:.1f} s, {stats['steps']} steps, "
+                                          f"{stats['restarts']} restarts)")
+
+        writer.running = False
+        writer.join()
+        if writer.errors:
+            print(f"booking errors: {writer.errors}")
+
+
+if __name__ == "__main__":
+    main()
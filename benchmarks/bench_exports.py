@@ -0,0 +1,74 @@
+"""Peak Python memory while streaming ticket exports.
+
+Usage: python benchmarks/bench_exports.py [--rows 100000 1000000] [--format csv]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models import Base
+from exports import iter_rows, tickets_query, TICKET_COLUMNS, WRITERS
+
+
+def prepare_db(path: str, rows: int) -> sessionmaker:
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "INSERT INTO trips (id, departure_city, arrival_city, departure_date, departure_time, arrival_time,"
+        " bus_number, bus_name, bus_color, total_seats, available_seats, price, is_active)"
+        " VALUES (1, 'Ижевск', 'Глазов', ?, '10:00', '11:45', 'У456ББ18', 'ЛИАЗ-5256', 'Красный', 50, 0, 200.0, 1)",
+        (date.today().isoformat(),)
+    )
+    conn.executemany(
+        "INSERT INTO tickets (ticket_number, trip_id, passenger_name, passenger_phone, boarding_point,"
+        " status, payment_status, payment_amount, is_open_date) VALUES (?, 1, ?, ?, ?, 'confirmed', 'paid', 200.0, 0)",
+        ((f"B{i:08d}", "Иванов Иван Иванович", "+79120000000", "Автовокзал Ижевск") for i in range(rows))
+    )
+    conn.commit()
+    conn.close()
+    return sessionmaker(bind=engine)
+
+
+def run(rows: int, fmt: str):
+    with tempfile.TemporaryDirectory() as tmp:
+        Session = prepare_db(os.path.join(tmp, "bench.db"), rows)
+        header = [name for name, _ in TICKET_COLUMNS]
+        today = date.today()
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        total = 0
+        body = WRITERS[fmt](header, iter_rows(lambda s: tickets_query(s, today, today), session_factory=Session))
+        for chunk in body:
+            total += len(chunk)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    print(f"{fmt:8s} rows={rows:>9d}: {elapsed:6.2f} s, {total / 1e6:8.1f} MB out, "
+          f"peak python memory {peak / 1e6:6.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--format", choices=sorted(WRITERS), default="csv")
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        run(rows, args.format)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Cold import time of the application, measured with `python -X importtime`.
+
+Only the cumulative time of the module itself is counted, not the
+interpreter startup imports (`site`, `encodings`) that -X importtime also
+reports. Exits with a non-zero status when the median exceeds the budget,
+so it can run as a CI check.
+
+Usage: python benchmarks/bench_import.py [--module main] [--budget-ms 1200] [--runs 5] [--top 15]
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# `main` measured 660-830 ms (median of 5 runs about 770 ms); the budget leaves
+# ~50% headroom so CI catches a heavy new import rather than machine noise
+IMPORT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "1200"))
+
+LINE_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$")
+
+# Modules that must not be imported at startup
+LAZY_MODULES = ["passlib", "jose", "uvicorn", "openpyxl", "pyarrow", "brotli"]
+
+
+def measure(module: str):
+    env = dict(os.environ)
+    env.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise SystemExit(result.stderr)
+
+    entries = []
+    for line in result.stderr.splitlines():
+        match = LINE_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append((name, int(self_us), int(cumulative_us), len(indent) // 2))
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    runs = [measure(args.module) for _ in range(args.runs)]
+    totals = sorted(next(cum for name, _, cum, depth in entries if name == args.module and depth == 0) / 1000
+                    for entries in runs)
+    median = totals[len(totals) // 2]
+
+    last = runs[-1]
+    print(f"Top-level imports of `{args.module}` (cumulative, last run):")
+    top_level = [(name, cum) for name, _, cum, depth in last if depth <= 1]
+    for name, cum in sorted(top_level, key=lambda x: -x[1])[:args.top]:
+        print(f"  {cum / 1000:8.1f} ms  {name}")
+
+    imported = {name.split(".")[0] for name, _, _, _ in last}
+    eager = [name for name in LAZY_MODULES if name in imported]
+    if eager:
+        print(f"Imported eagerly, expected lazy: {', '.join(eager)}")
+
+    print(f"Import time: median {median:.1f} ms over {args.runs} runs "
+          f"(min {totals[0]:.1f}, max {totals[-1]:.1f}), budget {args.budget_ms:.0f} ms")
+    if median > args.budget_ms or eager:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
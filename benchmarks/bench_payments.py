@@ -0,0 +1,90 @@
+"""Payment throughput under injected gateway latency.
+
+Usage: python benchmarks/bench_payments.py [--payments 500] [--latency 0.2 0.5 1.0]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models import Base, Trip, Ticket
+from payments import PaymentService, PaymentIntent, SimulatedGateway
+from datetime import date
+
+
+def prepare_db(path: str) -> sessionmaker:
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)
+
+
+def add_tickets(Session: sessionmaker, payments: int) -> List[int]:
+    """Tickets already in "processing", as POST /ticket/{id}/pay leaves them."""
+    db = Session()
+    trip = Trip(departure_city="Ижевск", arrival_city="Глазов", departure_date=date.today(),
+                departure_time="10:00", arrival_time="11:45", bus_number="У456ББ18",
+                bus_name="ЛИАЗ-5256", bus_color="Красный", total_seats=payments,
+                available_seats=0, price=200.0)
+    db.add(trip)
+    db.flush()
+    db.bulk_save_objects([
+        Ticket(ticket_number=f"B{i:06d}", trip_id=trip.id, passenger_name="Бенчмарк",
+               passenger_phone="+79120000000", boarding_point="Автовокзал",
+               payment_status="processing", payment_amount=200.0)
+        for i in range(payments)
+    ])
+    db.commit()
+    ids = [t[0] for t in db.query(Ticket.id).all()]
+    db.close()
+    return ids
+
+
+async def run(latency: float, failure_rate: float, payments: int, workers: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        Session = prepare_db(os.path.join(tmp, "bench.db"))
+        gateway = SimulatedGateway(latency=latency, jitter=latency * 0.2, failure_rate=failure_rate)
+        service = PaymentService(gateway, session_factory=Session, workers=workers)
+        # Started on an empty database, so start() has nothing to recover
+        # and every ticket is charged exactly once by the loop below
+        await service.start()
+        ids = add_tickets(Session, payments)
+
+        start = time.perf_counter()
+        for ticket_id in ids:
+            await service.submit(PaymentIntent(ticket_id=ticket_id, amount=200.0))
+        enqueue_time = time.perf_counter() - start
+        await service.stop()
+        total = time.perf_counter() - start
+
+        db = Session()
+        paid = db.query(Ticket).filter(Ticket.payment_status == "paid").count()
+        db.close()
+
+    print(f"latency={latency:.2f}s fail={failure_rate:.0%} workers={workers}: "
+          f"{payments / total:8.1f} payments/s, paid={paid}/{payments}, "
+          f"retries={service.stats['retries']}, commits={service.stats['commits']}, "
+          f"enqueue={enqueue_time * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--payments", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=64)
+    parser.add_argument("--latency", type=float, nargs="+", default=[0.05, 0.2, 0.5])
+    parser.add_argument("--failure-rate", type=float, default=0.1)
+    args = parser.parse_args()
+
+    for latency in args.latency:
+        asyncio.run(run(latency, args.failure_rate, args.payments, args.workers))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Bus conflict check: per-vehicle interval index vs scanning the bus's trips.
+
+Usage: python benchmarks/bench_schedule.py [--trips 10000 100000] [--buses 50]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models import Base, Trip
+from vehicle_schedule import VehicleIndex, trip_interval, validate_schedule
+
+
+def generate(trips: int, buses: int):
+    """Back-to-back trips per bus, some of them overnight."""
+    rng = random.Random(1)
+    per_bus = trips // buses
+    schedule = []
+    for b in range(buses):
+        cursor = 5 * 60
+        day = date.today()
+        for _ in range(per_bus):
+            duration = rng.choice([90, 105, 120, 240])
+            dep = cursor % 1440
+            arr = (cursor + duration) % 1440
+            schedule.append({
+                "bus_number": f"У{b:03d}АА18",
+                "departure_date": day + timedelta(days=cursor // 1440),
+                "departure_time": f"{dep // 60:02d}:{dep % 60:02d}",
+                "arrival_time": f"{arr // 60:02d}:{arr % 60:02d}",
+            })
+            cursor += duration + rng.choice([15, 30, 60, 300])
+    return schedule
+
+
+def prepare_db(path: str, schedule) -> sessionmaker:
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO trips (departure_city, arrival_city, departure_date, departure_time, arrival_time,"
+        " bus_number, bus_name, bus_color, total_seats, available_seats, price, is_active)"
+        " VALUES ('Ижевск', 'Глазов', ?, ?, ?, ?, 'ПАЗ-3205', 'Белый', 45, 45, 150.0, 1)",
+        ((t["departure_date"].isoformat(), t["departure_time"], t["arrival_time"], t["bus_number"]) for t in schedule)
+    )
+    conn.commit()
+    conn.close()
+    return sessionmaker(bind=engine)
+
+
+def naive_conflicts(Session, bus_number, departure_date, departure_time, arrival_time):
+    start, end = trip_interval(departure_date, departure_time, arrival_time)
+    db = Session()
+    try:
+        rows = db.query(Trip.id, Trip.departure_date, Trip.departure_time, Trip.arrival_time).filter(
+            Trip.bus_number == bus_number, Trip.is_active == 1
+        ).all()
+    finally:
+        db.close()
+    found = []
+    for trip_id, d, dep, arr in rows:
+        s, e = trip_interval(d, dep, arr)
+        if s < end and e > start:
+            found.append(trip_id)
+    return found
+
+
+def timed(fn, probes):
+    samples = []
+    for probe in probes:
+        t0 = time.perf_counter()
+        fn(*probe)
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples)
+
+
+def run(trips: int, buses: int):
+    schedule = generate(trips, buses)
+    rng = random.Random(2)
+    probes = [(t["bus_number"], t["departure_date"], "12:00", "13:30") for t in rng.sample(schedule, 200)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        Session = prepare_db(os.path.join(tmp, "bench.db"), schedule)
+        index = VehicleIndex(session_factory=Session)
+
+        t0 = time.perf_counter()
+        index.load()
+        load = (time.perf_counter() - t0) * 1000
+
+        naive = timed(lambda *p: naive_conflicts(Session, *p), probes)
+        indexed = timed(index.conflicts, probes)
+
+        t0 = time.perf_counter()
+        found = validate_schedule(schedule)
+        bulk = (time.perf_counter() - t0) * 1000
+
+    print(f"trips={trips:>7d} buses={buses}: index load {load:7.1f} ms, check p50 scan {naive:7.3f} ms "
+          f"vs index {indexed:6.3f} ms, bulk validation {bulk:7.1f} ms ({len(found)} conflicts)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trips", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--buses", type=int, default=50)
+    args = parser.parse_args()
+
+    for trips in args.trips:
+        run(trips, args.buses)
+
+
+if __name__ == "__main__":
+    main()
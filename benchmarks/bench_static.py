@@ -0,0 +1,62 @@
+"""Bytes transferred and response time for static assets and HTML pages,
+with and without compression, plus an estimated load time on a 3G link.
+
+Usage: python benchmarks/bench_static.py [--requests 200]
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+
+from fastapi.testclient import TestClient
+
+# Regional 3G: ~400 kbit/s downstream, 300 ms round trip
+LINK_BYTES_PER_SEC = 400_000 / 8
+LINK_RTT = 0.3
+
+ENCODINGS = ["identity", "gzip", "br, gzip"]
+
+
+def measure(client: TestClient, url: str, accept_encoding: str, requests: int):
+    headers = {"Accept-Encoding": accept_encoding}
+    first = client.get(url, headers=headers)
+    times = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        client.get(url, headers=headers)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    wire_bytes = int(first.headers.get("content-length", len(first.content)))
+    return first.headers.get("content-encoding", "-"), wire_bytes, times[len(times) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    from main import app
+
+    with TestClient(app) as client:
+        page = client.get("/user").text
+        css_url = re.search(r'href="(/static/[^"]+\.css)"', page).group(1)
+        urls = ["/", "/user", "/tickets", css_url, "/static/css/udmurt-style.css"]
+
+        print(f"{'url':48s} {'accept':10s} {'encoding':8s} {'bytes':>8s} {'server p50':>11s} {'3G est.':>8s}")
+        for url in urls:
+            for accept in ENCODINGS:
+                encoding, wire_bytes, p50 = measure(client, url, accept, args.requests)
+                link_time = LINK_RTT + wire_bytes / LINK_BYTES_PER_SEC
+                print(f"{url:48s} {accept:10s} {encoding:8s} {wire_bytes:8d} "
+                      f"{p50 * 1000:8.2f} ms {link_time * 1000:5.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
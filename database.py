@@ -1,15 +1,23 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./bus_schedule.db")
+# Write-ahead log for SQLite: readers, including online backups, do not
+# block booking writers (disable with SQLITE_WAL=0)
+SQLITE_WAL = os.getenv("SQLITE_WAL", "1") == "1"
 
 engine = create_engine(
     DATABASE_URL,
     connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
 )
 
+if SQLITE_WAL and DATABASE_URL.startswith("sqlite"):
+    @event.listens_for(engine, "connect")
+    def set_wal_mode(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA journal_mode=WAL")
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -0,0 +1,219 @@
+import csv
+import io
+import os
+import tempfile
+from datetime import date
+from typing import Callable, Iterator, List, Sequence
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func
+from sqlalchemy.orm import Query, Session
+
+from database import SessionLocal
+from models import Trip, Ticket
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "2000"))
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+MANIFEST_COLUMNS = [
+    ("Номер билета", Ticket.ticket_number),
+    ("ФИО", Ticket.passenger_name),
+    ("Телефон", Ticket.passenger_phone),
+    ("Место посадки", Ticket.boarding_point),
+    ("Статус", Ticket.status),
+    ("Оплата", Ticket.payment_status),
+]
+
+TICKET_COLUMNS = [
+    ("ticket_id", Ticket.id),
+    ("ticket_number", Ticket.ticket_number),
+    ("trip_id", Ticket.trip_id),
+    ("departure_date", Trip.departure_date),
+    ("departure_time", Trip.departure_time),
+    ("departure_city", Trip.departure_city),
+    ("arrival_city", Trip.arrival_city),
+    ("bus_number", Trip.bus_number),
+    ("passenger_name", Ticket.passenger_name),
+    ("passenger_phone", Ticket.passenger_phone),
+    ("boarding_point", Ticket.boarding_point),
+    ("status", Ticket.status),
+    ("payment_status", Ticket.payment_status),
+    ("payment_amount", Ticket.payment_amount),
+    ("created_at", Ticket.created_at),
+]
+
+REVENUE_COLUMNS = [
+    ("departure_date", Trip.departure_date),
+    ("trip_id", Trip.id),
+    ("departure_city", Trip.departure_city),
+    ("arrival_city", Trip.arrival_city),
+    ("departure_time", Trip.departure_time),
+    ("tickets_paid", func.count(Ticket.id)),
+    ("revenue", func.coalesce(func.sum(Ticket.payment_amount), 0.0)),
+]
+
+
+def manifest_query(db: Session, trip_id: int) -> Query:
+    return db.query(*[c for _, c in MANIFEST_COLUMNS]).filter(
+        Ticket.trip_id == trip_id,
+        Ticket.payment_status == "paid"
+    ).order_by(Ticket.created_at)
+
+
+def tickets_query(db: Session, date_from: date, date_to: date) -> Query:
+    return db.query(*[c for _, c in TICKET_COLUMNS]).join(Trip).filter(
+        Trip.departure_date >= date_from,
+        Trip.departure_date <= date_to
+    ).order_by(Trip.departure_date, Ticket.id)
+
+
+def revenue_query(db: Session, date_from: date, date_to: date) -> Query:
+    return db.query(*[c for _, c in REVENUE_COLUMNS]).join(Ticket).filter(
+        Trip.departure_date >= date_from,
+        Trip.departure_date <= date_to,
+        Ticket.payment_status == "paid"
+    ).group_by(Trip.id).order_by(Trip.departure_date, Trip.departure_time)
+
+
+def iter_rows(build_query: Callable[[Session], Query], session_factory=SessionLocal) -> Iterator[tuple]:
+    """Yield rows from a server-side cursor in batches of EXPORT_BATCH_SIZE.
+
+    The session is owned by the generator because the response body is
+    produced after the request's dependencies have finished.
+    """
+    db = session_factory()
+    try:
+        query = build_query(db).execution_options(stream_results=True).yield_per(EXPORT_BATCH_SIZE)
+        for row in query:
+            yield tuple(row)
+    finally:
+        db.close()
+
+
+def _cell(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def stream_csv(header: Sequence[str], rows: Iterator[tuple]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=";")
+    # BOM so that Excel opens Cyrillic text correctly
+    buffer.write("\ufeff")
+    writer.writerow(header)
+    for row in rows:
+        writer.writerow([_cell(v) for v in row])
+        if buffer.tell() >= EXPORT_CHUNK_SIZE:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+def _stream_file(path: str) -> Iterator[bytes]:
+    try:
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(EXPORT_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.unlink(path)
+
+
+def _spool_path(suffix: str) -> str:
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    os.close(fd)
+    return path
+
+
+def stream_xlsx(header: Sequence[str], rows: Iterator[tuple]) -> Iterator[bytes]:
+    """XLSX is a zip archive, so rows are spooled through openpyxl's
+    write-only workbook into a temp file and the file is streamed out."""
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise HTTPException(status_code=501, detail="Экспорт в XLSX недоступен: не установлен openpyxl")
+
+    def generate():
+        path = _spool_path(".xlsx")
+        try:
+            wb = Workbook(write_only=True)
+            ws = wb.create_sheet()
+            ws.append(list(header))
+            for row in rows:
+                ws.append(list(row))
+            wb.save(path)
+        except Exception:
+            os.unlink(path)
+            raise
+        yield from _stream_file(path)
+
+    return generate()
+
+
+def stream_parquet(header: Sequence[str], rows: Iterator[tuple]) -> Iterator[bytes]:
+    """Rows are written as one Parquet row group per EXPORT_BATCH_SIZE rows."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise HTTPException(status_code=501, detail="Экспорт в Parquet недоступен: не установлен pyarrow")
+
+    def write_batch(writer, path: str, batch: List[tuple]):
+        columns = list(zip(*batch))
+        table = pa.table({name: list(col) for name, col in zip(header, columns)})
+        if writer is None:
+            writer = pq.ParquetWriter(path, table.schema, compression="zstd")
+        writer.write_table(table.cast(writer.schema))
+        return writer
+
+    def generate():
+        path = _spool_path(".parquet")
+        writer = None
+        try:
+            batch: List[tuple] = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= EXPORT_BATCH_SIZE:
+                    writer = write_batch(writer, path, batch)
+                    batch = []
+            if batch:
+                writer = write_batch(writer, path, batch)
+            if writer is None:
+                writer = pq.ParquetWriter(path, pa.schema([(name, pa.string()) for name in header]))
+            writer.close()
+        except Exception:
+            os.unlink(path)
+            raise
+        yield from _stream_file(path)
+
+    return generate()
+
+
+WRITERS = {
+    "csv": stream_csv,
+    "xlsx": stream_xlsx,
+    "parquet": stream_parquet,
+}
+
+
+def export_response(columns, build_query: Callable[[Session], Query], fmt: str, filename: str,
+                    allowed=("csv", "xlsx", "parquet")) -> StreamingResponse:
+    if fmt not in allowed:
+        raise HTTPException(status_code=400, detail=f"Неподдерживаемый формат: {fmt}")
+
+    header = [name for name, _ in columns]
+    body = WRITERS[fmt](header, iter_rows(build_query))
+    return StreamingResponse(body, media_type=MEDIA_TYPES[fmt], headers={
+        "Content-Disposition": f'attachment; filename="{filename}.{fmt}"'
+    })
@@ -2,6 +2,8 @@ from sqlalchemy.orm import Session
 from database import SessionLocal, engine
 from models import Base, Trip, Ticket, Dispatcher
 from auth import get_password_hash
+from phones import normalize_phone
+from vehicle_schedule import validate_schedule
 from datetime import date, timedelta
 
 def create_sample_data():
@@ -100,6 +102,14 @@ def create_sample_data():
             }
         ]
 
+        # Refuse a generated schedule that puts one bus on overlapping trips
+        conflicts = validate_schedule(trips_data)
+        if conflicts:
+            raise ValueError("; ".join(
+                f"{a['bus_number']}: {a['departure_time']}-{a['arrival_time']} и {b['departure_time']}-{b['arrival_time']}"
+                for a, b in conflicts
+            ))
+
         trips = []
         for trip_data in trips_data:
             trip = Trip(**trip_data)
@@ -145,6 +155,7 @@ def create_sample_data():
 
         for ticket_data in tickets_data:
             ticket = Ticket(**ticket_data)
+            ticket.passenger_phone_normalized = normalize_phone(ticket.passenger_phone)
             db.add(ticket)
 
         db.commit()
@@ -1,37 +1,50 @@
-from fastapi import FastAPI, Request, Depends, HTTPException, Form, status, Query
+from fastapi import FastAPI, APIRouter, Request, Depends, HTTPException, Form, status, Query
 from fastapi.responses import RedirectResponse, HTMLResponse, JSONResponse
-from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import case, func
 from typing import List, Optional
-import uvicorn
+from contextlib import asynccontextmanager
+import asyncio
+import json
+import os
 import random
 from datetime import datetime, date, timedelta
 
-from database import engine, get_db
-from models import Base, Trip, Ticket, Dispatcher
+from database import get_db
+from models import Trip, Ticket, Dispatcher
 from auth import authenticate_dispatcher, create_access_token, get_password_hash, get_current_dispatcher
-
-# Create database tables
-Base.metadata.create_all(bind=engine)
-
-app = FastAPI(title="Bus Ticket System")
-
-# Mount static files
-app.mount("/static", StaticFiles(directory="static"), name="static")
+from assets import PrecompressedStaticFiles, TextGZipMiddleware, asset_url, load_manifest
+from phones import normalize_phone, phone_search_cache
+from admission import admission, BookingRequest, Overloaded, LoadSheddingMiddleware
+from audit import audit_log, AUDIT_PAGE_SIZE
+from analytics import rollups
+from vehicle_schedule import vehicle_index
+from backup import backup_scheduler
+from payments import payment_service, PaymentIntent, GatewayResult, verify_webhook, PAYMENT_WEBHOOK_SECRET
+from exports import (export_response, manifest_query, tickets_query, revenue_query,
+                     MANIFEST_COLUMNS, TICKET_COLUMNS, REVENUE_COLUMNS)
+
+# Run schema migrations in the lifespan hook (disable with AUTO_MIGRATE=0
+# when `python migrate.py` is part of the deploy)
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "1") == "1"
+
+router = APIRouter()
 
 # Templates
 templates = Jinja2Templates(directory="templates")
+templates.env.globals["asset_url"] = asset_url
+
+# Trip fields whose changes are written to the audit log
+TRIP_AUDIT_FIELDS = ["departure_city", "arrival_city", "departure_date", "departure_time", "arrival_time",
+                     "bus_number", "bus_name", "bus_color", "total_seats", "available_seats", "price"]
 
-# Ticket number generator with collision check
-def generate_ticket_number(db: Session) -> str:
-    existing = set(n[0] for n in db.query(Ticket.ticket_number).all())
-    for num in range(1, 1000):
-        candidate = f"{num:03d}"
-        if candidate not in existing:
-            return candidate
-    raise HTTPException(status_code=500, detail="Нет свободных номеров билетов")
+
+def trip_phones(db: Session, trip_id: int) -> List[str]:
+    """Normalised phones of a trip's passengers, for phone search cache invalidation."""
+    return [phone for (phone,) in db.query(Ticket.passenger_phone_normalized).filter(
+        Ticket.trip_id == trip_id, Ticket.passenger_phone_normalized.isnot(None)
+    ).distinct()]
 
 
 def require_super(dispatcher: Dispatcher):
@@ -42,12 +55,12 @@ def require_super(dispatcher: Dispatcher):
 # Routes
 
 # User routes (no authentication required)
-@app.get("/", response_class=HTMLResponse)
+@router.get("/", response_class=HTMLResponse)
 async def role_choice(request: Request):
     return templates.TemplateResponse("role_choice.html", {"request": request})
 
 
-@app.get("/user", response_class=HTMLResponse)
+@router.get("/user", response_class=HTMLResponse)
 async def user_home(request: Request, selected_date: Optional[str] = None, db: Session = Depends(get_db)):
     today = date.today()
     selected = date.today()
@@ -77,7 +90,7 @@ async def user_home(request: Request, selected_date: Optional[str] = None, db: S
         "tomorrow": today + timedelta(days=1)
     })
 
-@app.get("/trip/{trip_id}", response_class=HTMLResponse)
+@router.get("/trip/{trip_id}", response_class=HTMLResponse)
 async def trip_details(request: Request, trip_id: int, db: Session = Depends(get_db)):
     trip = db.query(Trip).filter(Trip.id == trip_id, Trip.is_active == 1).first()
     if not trip:
@@ -88,7 +101,7 @@ async def trip_details(request: Request, trip_id: int, db: Session = Depends(get
         "trip": trip
     })
 
-@app.post("/trip/{trip_id}/book")
+@router.post("/trip/{trip_id}/book")
 async def book_ticket(
     request: Request,
     trip_id: int,
@@ -105,6 +118,13 @@ async def book_ticket(
             "error": "Необходимо согласиться с обработкой персональных данных"
         })
 
+    phone_normalized = normalize_phone(passenger_phone)
+    if not phone_normalized:
+        return templates.TemplateResponse("error.html", {
+            "request": request,
+            "error": "Некорректный номер телефона"
+        })
+
     trip = db.query(Trip).filter(Trip.id == trip_id, Trip.is_active == 1).first()
     if not trip:
         raise HTTPException(status_code=404, detail="Trip not found")
@@ -115,76 +135,172 @@ async def book_ticket(
             "error": "Нет доступных мест на этот рейс"
         })
 
-    # Create ticket with unique number
-    ticket_number = generate_ticket_number(db)
-    ticket = Ticket(
-        ticket_number=ticket_number,
-        trip_id=trip_id,
-        passenger_name=passenger_name,
-        passenger_phone=passenger_phone,
-        boarding_point=boarding_point,
-        payment_status="unpaid",
-        payment_amount=trip.price
-    )
+    # Return the connection to the pool before waiting: the lane writer
+    # needs one to commit, and a surge would otherwise exhaust the pool
+    db.close()
 
-    db.add(ticket)
-    trip.available_seats -= 1
+    # Bookings for a trip are serialised through its admission lane; on a
+    # surge the passenger is placed in the waiting room instead
     try:
-        db.commit()
-        db.refresh(ticket)
-    except Exception:
-        db.rollback()
-        raise HTTPException(status_code=500, detail="Ошибка при создании билета")
+        booking = await admission.book(BookingRequest(
+            trip_id=trip_id,
+            passenger_name=passenger_name,
+            passenger_phone=passenger_phone,
+            passenger_phone_normalized=phone_normalized,
+            boarding_point=boarding_point
+        ))
+    except Overloaded as e:
+        return templates.TemplateResponse("error.html", {
+            "request": request,
+            "error": "Слишком много желающих купить билет. Попробуйте через минуту."
+        }, status_code=503, headers={"Retry-After": str(e.retry_after)})
+
+    if booking.error:
+        return templates.TemplateResponse("error.html", {
+            "request": request,
+            "error": booking.error
+        })
+
+    if not booking.done:
+        return RedirectResponse(url=f"/waiting-room/{booking.token}", status_code=303)
+
+    return RedirectResponse(url=f"/ticket/{booking.ticket_id}/pay", status_code=303)
+
+@router.get("/waiting-room/{token}", response_class=HTMLResponse)
+async def waiting_room(request: Request, token: str):
+    state = admission.position(token)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Booking not found")
+    if state["status"] == "done":
+        return RedirectResponse(url=f"/ticket/{state['ticket_id']}/pay", status_code=303)
+    if state["status"] == "failed":
+        return templates.TemplateResponse("error.html", {
+            "request": request,
+            "error": state["error"]
+        })
+
+    return templates.TemplateResponse("user_waiting_room.html", {
+        "request": request,
+        "token": token,
+        "state": state
+    })
+
+@router.get("/waiting-room/{token}/status")
+async def waiting_room_status(token: str):
+    state = admission.position(token)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Booking not found")
+    return state
+
+@router.get("/ticket/{ticket_id}/pay", response_class=HTMLResponse)
+async def payment_page(request: Request, ticket_id: int, db: Session = Depends(get_db)):
+    ticket = db.query(Ticket).filter(Ticket.id == ticket_id).first()
+    if not ticket:
+        raise HTTPException(status_code=404, detail="Ticket not found")
 
     return templates.TemplateResponse("user_payment.html", {
         "request": request,
         "ticket": ticket,
-        "trip": trip
+        "trip": ticket.trip
     })
 
-@app.post("/ticket/{ticket_id}/pay")
-async def pay_ticket(request: Request, ticket_id: int, db: Session = Depends(get_db)):
+@router.post("/ticket/{ticket_id}/pay")
+async def pay_ticket(request: Request, ticket_id: int, payment_method: str = Form("sbp"), db: Session = Depends(get_db)):
     ticket = db.query(Ticket).filter(Ticket.id == ticket_id).first()
     if not ticket:
         raise HTTPException(status_code=404, detail="Ticket not found")
 
-    # Mark as paid (in real app, this would integrate with payment system)
-    ticket.payment_status = "paid"
-    ticket.status = "pending_confirmation"
-    db.commit()
+    if ticket.payment_status == "paid":
+        return templates.TemplateResponse("user_success.html", {
+            "request": request,
+            "ticket": ticket
+        })
 
-    return templates.TemplateResponse("user_success.html", {
+    # Hand the payment over to the gateway queue and return immediately;
+    # the final status is committed back by the payment service.
+    if ticket.payment_status != "processing":
+        intent = PaymentIntent(
+            ticket_id=ticket.id,
+            amount=ticket.payment_amount,
+            method=payment_method or "sbp"
+        )
+        # Stored with the ticket so a restart resubmits the same intent id
+        ticket.payment_intent_id = intent.intent_id
+        ticket.payment_status = "processing"
+        ticket.status = "pending_confirmation"
+        db.commit()
+        await payment_service.submit(intent)
+
+    return templates.TemplateResponse("user_payment_processing.html", {
         "request": request,
         "ticket": ticket
     })
 
-@app.get("/tickets", response_class=HTMLResponse)
+@router.get("/ticket/{ticket_id}/payment-status")
+async def payment_status(ticket_id: int, db: Session = Depends(get_db)):
+    ticket = db.query(Ticket).filter(Ticket.id == ticket_id).first()
+    if not ticket:
+        raise HTTPException(status_code=404, detail="Ticket not found")
+    return {"ticket_id": ticket.id, "payment_status": ticket.payment_status}
+
+@router.post("/payments/webhook")
+async def payments_webhook(request: Request):
+    # Without a configured secret anyone could sign a "paid" notification
+    if not PAYMENT_WEBHOOK_SECRET:
+        raise HTTPException(status_code=503, detail="Webhook is not configured")
+
+    body = await request.body()
+    if not verify_webhook(body, request.headers.get("X-Signature")):
+        raise HTTPException(status_code=403, detail="Invalid signature")
+
+    try:
+        payload = await request.json()
+        result = GatewayResult(
+            intent_id=str(payload["intent_id"]),
+            ticket_id=int(payload["ticket_id"]),
+            status=payload["status"],
+            error=payload.get("error")
+        )
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid payload")
+
+    if result.status not in ("paid", "failed"):
+        raise HTTPException(status_code=400, detail="Invalid status")
+
+    await payment_service.report(result)
+    return {"success": True}
+
+@router.get("/tickets", response_class=HTMLResponse)
 async def user_tickets(request: Request):
     return templates.TemplateResponse("user_tickets.html", {"request": request})
 
-@app.get("/tickets/search")
+@router.get("/tickets/search")
 async def search_tickets_get(request: Request):
     return RedirectResponse(url="/tickets", status_code=302)
 
-@app.post("/tickets/search")
+@router.post("/tickets/search")
 async def search_tickets(
     request: Request,
     phone: str = Form(...),
     db: Session = Depends(get_db)
 ):
     try:
-        # Get current tickets (not expired)
+        phone_normalized = normalize_phone(phone)
+        tickets = phone_search_cache.get(phone_normalized) if phone_normalized else None
+        if tickets is None:
+            tickets = []
+            if phone_normalized:
+                # Single index seek; trips are loaded in the same query so the
+                # detached tickets can be cached and rendered later
+                tickets = db.query(Ticket).options(joinedload(Ticket.trip)).filter(
+                    Ticket.passenger_phone_normalized == phone_normalized
+                ).order_by(Ticket.id).all()
+                phone_search_cache.set(phone_normalized, tickets)
+
+        # Split into current and archived (expired) tickets
         today = date.today()
-        current_tickets = db.query(Ticket).join(Trip).filter(
-            Ticket.passenger_phone == phone,
-            Trip.departure_date >= today
-        ).all()
-
-        # Get archived tickets (expired)
-        archived_tickets = db.query(Ticket).join(Trip).filter(
-            Ticket.passenger_phone == phone,
-            Trip.departure_date < today
-        ).all()
+        current_tickets = [t for t in tickets if t.trip.departure_date >= today]
+        archived_tickets = [t for t in tickets if t.trip.departure_date < today]
 
         return templates.TemplateResponse("user_tickets.html", {
             "request": request,
@@ -200,7 +316,7 @@ async def search_tickets(
             "searched": False
         })
 
-@app.get("/ticket/{ticket_id}", response_class=HTMLResponse)
+@router.get("/ticket/{ticket_id}", response_class=HTMLResponse)
 async def ticket_details(request: Request, ticket_id: int, db: Session = Depends(get_db)):
     ticket = db.query(Ticket).filter(Ticket.id == ticket_id).first()
     if not ticket:
@@ -212,11 +328,11 @@ async def ticket_details(request: Request, ticket_id: int, db: Session = Depends
     })
 
 # Dispatcher routes
-@app.get("/dispatcher/login", response_class=HTMLResponse)
+@router.get("/dispatcher/login", response_class=HTMLResponse)
 async def dispatcher_login_page(request: Request):
     return templates.TemplateResponse("dispatcher_login.html", {"request": request})
 
-@app.post("/dispatcher/login")
+@router.post("/dispatcher/login")
 async def dispatcher_login(
     request: Request,
     username: str = Form(...),
@@ -252,7 +368,7 @@ async def dispatcher_login(
     )
     return response
 
-@app.get("/dispatcher/dashboard", response_class=HTMLResponse)
+@router.get("/dispatcher/dashboard", response_class=HTMLResponse)
 async def dispatcher_dashboard(
     request: Request,
     db: Session = Depends(get_db),
@@ -300,7 +416,7 @@ async def dispatcher_dashboard(
         "pending_dispatchers": pending_dispatchers
     })
 
-@app.get("/dispatcher/trips", response_class=HTMLResponse)
+@router.get("/dispatcher/trips", response_class=HTMLResponse)
 async def dispatcher_trips(request: Request, db: Session = Depends(get_db), current_dispatcher: Dispatcher = Depends(get_current_dispatcher)):
     today = date.today()
     tomorrow = today + timedelta(days=1)
@@ -316,7 +432,7 @@ async def dispatcher_trips(request: Request, db: Session = Depends(get_db), curr
         "tomorrow": tomorrow
     })
 
-@app.get("/dispatcher/trip/{trip_id}", response_class=HTMLResponse)
+@router.get("/dispatcher/trip/{trip_id}", response_class=HTMLResponse)
 async def dispatcher_trip_details(
     request: Request,
     trip_id: int,
@@ -339,7 +455,167 @@ async def dispatcher_trip_details(
     })
 
 
-@app.get("/dispatcher/trip/{trip_id}/edit", response_class=HTMLResponse)
+@router.get("/dispatcher/trip/{trip_id}/manifest")
+async def export_trip_manifest(
+    trip_id: int,
+    format: str = Query("csv"),
+    db: Session = Depends(get_db),
+    current_dispatcher: Dispatcher = Depends(get_current_dispatcher)
+):
+    trip = db.query(Trip).filter(Trip.id == trip_id).first()
+    if not trip:
+        raise HTTPException(status_code=404, detail="Trip not found")
+
+    filename = f"manifest_{trip.departure_date.isoformat()}_{trip.id}"
+    return export_response(MANIFEST_COLUMNS, lambda s: manifest_query(s, trip_id), format, filename,
+                           allowed=("csv", "xlsx"))
+
+
+def parse_export_period(date_from: str, date_to: str):
+    try:
+        start = date.fromisoformat(date_from)
+        end = date.fromisoformat(date_to)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Некорректный формат даты, ожидается YYYY-MM-DD")
+    if start > end:
+        raise HTTPException(status_code=400, detail="Дата начала позже даты окончания")
+    return start, end
+
+
+@router.get("/dispatcher/export/tickets")
+async def export_tickets(
+    date_from: str = Query(...),
+    date_to: str = Query(...),
+    format: str = Query("csv"),
+    current_dispatcher: Dispatcher = Depends(get_current_dispatcher)
+):
+    start, end = parse_export_period(date_from, date_to)
+    return export_response(TICKET_COLUMNS, lambda s: tickets_query(s, start, end), format,
+                           f"tickets_{start.isoformat()}_{end.isoformat()}")
+
+
+@router.get("/dispatcher/export/revenue")
+async def export_revenue(
+    date_from: str = Query(...),
+    date_to: str = Query(...),
+    format: str = Query("csv"),
+    current_dispatcher: Dispatcher = Depends(get_current_dispatcher)
+):
+    start, end = parse_export_period(date_from, date_to)
+    return export_response(REVENUE_COLUMNS, lambda s: revenue_query(s, start, end), format,
+                           f"revenue_{start.isoformat()}_{end.isoformat()}")
+
+@router.get("/dispatcher/audit", response_class=HTMLResponse)
+async def dispatcher_audit(
+    request: Request,
+    trip_id: Optional[int] = None,
+    ticket_id: Optional[int] = None,
+    dispatcher_id: Optional[int] = None,
+    before_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+    current_dispatcher: Dispatcher = Depends(get_current_dispatcher)
+):
+    # The audit log may live in a separate database, so it is queried
+    # through audit_log (which also flushes pending events first)
+    events = await asyncio.to_thread(audit_log.query, trip_id, ticket_id, dispatcher_id, before_id,
+                                     AUDIT_PAGE_SIZE + 1)
+
+    has_more = len(events) > AUDIT_PAGE_SIZE
+    events = events[:AUDIT_PAGE_SIZE]
+
+    dispatcher_ids = {e.dispatcher_id for e in events if e.dispatcher_id is not None}
+    dispatchers = {}
+    if dispatcher_ids:
+        dispatchers = dict(db.query(Dispatcher.id, Dispatcher.username).filter(
+            Dispatcher.id.in_(dispatcher_ids)
+        ).all())
+
+    filters = {k: v for k, v in {"trip_id": trip_id, "ticket_id": ticket_id,
+                                 "dispatcher_id": dispatcher_id}.items() if v is not None}
+
+    return templates.TemplateResponse("dispatcher_audit.html", {
+        "request": request,
+        "events": [(e, json.loads(e.data) if e.data else {}) for e in events],
+        "dispatchers": dispatchers,
+        "filters": filters,
+        "next_before_id": events[-1].id if has_more else None
+    })
+
+def parse_analytics_period(date_from: Optional[str], date_to: Optional[str]):
+    # Defaults to the last twelve months
+    if not date_from and not date_to:
+        end = date.today()
+        return end - timedelta(days=365), end
+    return parse_export_period(date_from or "", date_to or "")
+
+
+@router.get("/dispatcher/analytics", response_class=HTMLResponse)
+async def dispatcher_analytics(
+    request: Request,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    route: Optional[str] = None,
+    current_dispatcher: Dispatcher = Depends(get_current_dispatcher)
+):
+    start, end = parse_analytics_period(date_from, date_to)
+    report = await asyncio.to_thread(rollups.report, start, end, route or None)
+
+    return templates.TemplateResponse("dispatcher_analytics.html", {
+        "request": request,
+        "report": report
+    })
+
+
+@router.get("/dispatcher/analytics/data")
+async def dispatcher_analytics_data(
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    route: Optional[str] = None,
+    current_dispatcher: Dispatcher = Depends(get_current_dispatcher)
+):
+    start, end = parse_analytics_period(date_from, date_to)
+    return await asyncio.to_thread(rollups.report, start, end, route or None)
+
+def bus_conflicts(db: Session, bus_number: str, departure_date: date, departure_time: str,
+                  arrival_time: str, exclude_trip_id: Optional[int] = None) -> List[Trip]:
+    """Active trips that already occupy the bus during the proposed trip."""
+    try:
+        trip_ids = vehicle_index.conflicts(bus_number, departure_date, departure_time, arrival_time,
+                                           exclude_trip_id=exclude_trip_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Некорректное время, ожидается HH:MM")
+    if not trip_ids:
+        return []
+    return db.query(Trip).filter(Trip.id.in_(trip_ids)).order_by(Trip.departure_date, Trip.departure_time).all()
+
+
+@router.get("/dispatcher/bus/{bus_number}/free-windows")
+async def bus_free_windows(
+    bus_number: str,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    min_minutes: int = Query(0, ge=0),
+    current_dispatcher: Dispatcher = Depends(get_current_dispatcher)
+):
+    if date_from or date_to:
+        start, end = parse_export_period(date_from or "", date_to or "")
+    else:
+        start = date.today()
+        end = start + timedelta(days=6)
+
+    windows = vehicle_index.free_windows(bus_number, start, end, min_minutes)
+    return {
+        "bus_number": bus_number,
+        "date_from": start.isoformat(),
+        "date_to": end.isoformat(),
+        "windows": [
+            {"start": a.isoformat(timespec="minutes"), "end": b.isoformat(timespec="minutes"),
+             "minutes": int((b - a).total_seconds() // 60)}
+            for a, b in windows
+        ]
+    }
+
+@router.get("/dispatcher/trip/{trip_id}/edit", response_class=HTMLResponse)
 async def edit_trip_page(
     request: Request,
     trip_id: int,
@@ -358,7 +634,7 @@ async def edit_trip_page(
     })
 
 
-@app.post("/dispatcher/trip/{trip_id}/edit")
+@router.post("/dispatcher/trip/{trip_id}/edit")
 async def edit_trip(
     request: Request,
     trip_id: int,
@@ -379,12 +655,26 @@ async def edit_trip(
     if not trip:
         raise HTTPException(status_code=404, detail="Trip not found")
 
-    sold = trip.total_seats - trip.available_seats
-    new_available = max(0, total_seats - sold)
+    new_date = date.fromisoformat(departure_date)
+    conflicts = bus_conflicts(db, bus_number, new_date, departure_time, arrival_time, exclude_trip_id=trip_id)
+    if conflicts:
+        return templates.TemplateResponse("dispatcher_edit_trip.html", {
+            "request": request,
+            "trip": trip,
+            "today": date.today(),
+            "error": f"Автобус {bus_number} уже занят в это время",
+            "conflicts": conflicts
+        }, status_code=409)
+
+    # Computed in the UPDATE from the row's current values: a lane writer may
+    # be selling seats on this trip in another thread right now
+    sold = Trip.total_seats - Trip.available_seats
+    new_available = case((sold > total_seats, 0), else_=total_seats - sold)
+    before = {field: getattr(trip, field) for field in TRIP_AUDIT_FIELDS}
 
     trip.departure_city = departure_city
     trip.arrival_city = arrival_city
-    trip.departure_date = date.fromisoformat(departure_date)
+    trip.departure_date = new_date
     trip.departure_time = departure_time
     trip.arrival_time = arrival_time
     trip.bus_number = bus_number
@@ -395,11 +685,18 @@ async def edit_trip(
     trip.price = price
 
     db.commit()
+    phone_search_cache.invalidate(*trip_phones(db, trip_id))
+    vehicle_index.update_trip(trip)
+    rollups.mark_dirty(before["departure_date"], trip.departure_date)
+
+    changes = {field: [before[field], getattr(trip, field)] for field in TRIP_AUDIT_FIELDS
+               if before[field] != getattr(trip, field)}
+    audit_log.record("trip.edit", current_dispatcher, trip_id=trip_id, changes=changes)
 
     return RedirectResponse(url=f"/dispatcher/trip/{trip_id}", status_code=302)
 
 
-@app.post("/dispatcher/trip/{trip_id}/delete")
+@router.post("/dispatcher/trip/{trip_id}/delete")
 async def delete_trip(
     request: Request,
     trip_id: int,
@@ -410,14 +707,26 @@ async def delete_trip(
     if not trip:
         raise HTTPException(status_code=404, detail="Trip not found")
 
+    route = f"{trip.departure_city} → {trip.arrival_city}"
+    departure = f"{trip.departure_date.isoformat()} {trip.departure_time}"
+
+    phones = trip_phones(db, trip_id)
+
     # Remove tickets first
-    db.query(Ticket).filter(Ticket.trip_id == trip_id).delete()
+    tickets_deleted = db.query(Ticket).filter(Ticket.trip_id == trip_id).delete()
+    departure_date = trip.departure_date
     db.delete(trip)
     db.commit()
+    phone_search_cache.invalidate(*phones)
+    vehicle_index.remove_trip(trip_id)
+    rollups.mark_dirty(departure_date)
+
+    audit_log.record("trip.delete", current_dispatcher, trip_id=trip_id,
+                     route=route, departure=departure, tickets_deleted=tickets_deleted)
 
     return {"success": True}
 
-@app.post("/dispatcher/ticket/{ticket_id}/status")
+@router.post("/dispatcher/ticket/{ticket_id}/status")
 async def update_ticket_status(
     request: Request,
     ticket_id: int,
@@ -430,15 +739,19 @@ async def update_ticket_status(
     if not ticket:
         raise HTTPException(status_code=404, detail="Ticket not found")
 
+    old_status = ticket.status
     ticket.status = status
     if reason:
         ticket.status_reason = reason
 
     db.commit()
+    phone_search_cache.invalidate(ticket.passenger_phone_normalized)
+    audit_log.record("ticket.status", current_dispatcher, trip_id=ticket.trip_id, ticket_id=ticket.id,
+                     old=old_status, new=status, reason=reason or None)
 
     return RedirectResponse(url=f"/dispatcher/trip/{ticket.trip_id}", status_code=302)
 
-@app.get("/dispatcher/create-trip", response_class=HTMLResponse)
+@router.get("/dispatcher/create-trip", response_class=HTMLResponse)
 async def create_trip_page(request: Request, current_dispatcher: Dispatcher = Depends(get_current_dispatcher)):
     from datetime import datetime
     now = datetime.now()
@@ -450,7 +763,7 @@ async def create_trip_page(request: Request, current_dispatcher: Dispatcher = De
         "today": today
     })
 
-@app.post("/dispatcher/create-trip")
+@router.post("/dispatcher/create-trip")
 async def create_trip(
     request: Request,
     departure_city: str = Form(...),
@@ -466,10 +779,21 @@ async def create_trip(
     db: Session = Depends(get_db),
     current_dispatcher: Dispatcher = Depends(get_current_dispatcher)
 ):
+    trip_date = date.fromisoformat(departure_date)
+    conflicts = bus_conflicts(db, bus_number, trip_date, departure_time, arrival_time)
+    if conflicts:
+        return templates.TemplateResponse("dispatcher_create_trip.html", {
+            "request": request,
+            "now": datetime.now(),
+            "today": date.today(),
+            "error": f"Автобус {bus_number} уже занят в это время",
+            "conflicts": conflicts
+        }, status_code=409)
+
     trip = Trip(
         departure_city=departure_city,
         arrival_city=arrival_city,
-        departure_date=date.fromisoformat(departure_date),
+        departure_date=trip_date,
         departure_time=departure_time,
         arrival_time=arrival_time,
         bus_number=bus_number,
@@ -482,16 +806,21 @@ async def create_trip(
 
     db.add(trip)
     db.commit()
+    vehicle_index.add_trip(trip)
+    rollups.mark_dirty(trip.departure_date)
+
+    audit_log.record("trip.create", current_dispatcher, trip_id=trip.id,
+                     route=f"{departure_city} → {arrival_city}", departure=f"{departure_date} {departure_time}")
 
     return RedirectResponse(url="/dispatcher/trips", status_code=302)
 
 
-@app.get("/dispatcher/register", response_class=HTMLResponse)
+@router.get("/dispatcher/register", response_class=HTMLResponse)
 async def dispatcher_register_page(request: Request):
     return templates.TemplateResponse("dispatcher_register.html", {"request": request})
 
 
-@app.post("/dispatcher/register")
+@router.post("/dispatcher/register")
 async def dispatcher_register(
     request: Request,
     username: str = Form(...),
@@ -526,7 +855,7 @@ async def dispatcher_register(
     })
 
 
-@app.post("/dispatcher/approve/{dispatcher_id}")
+@router.post("/dispatcher/approve/{dispatcher_id}")
 async def approve_dispatcher(
     dispatcher_id: int,
     db: Session = Depends(get_db),
@@ -538,10 +867,12 @@ async def approve_dispatcher(
         raise HTTPException(status_code=404, detail="Dispatcher not found")
     disp.is_approved = 1
     db.commit()
+    audit_log.record("dispatcher.approve", current_dispatcher,
+                     target_id=disp.id, target_username=disp.username)
     return RedirectResponse(url="/dispatcher/dashboard", status_code=302)
 
 
-@app.post("/dispatcher/reject/{dispatcher_id}")
+@router.post("/dispatcher/reject/{dispatcher_id}")
 async def reject_dispatcher(
     dispatcher_id: int,
     db: Session = Depends(get_db),
@@ -551,15 +882,56 @@ async def reject_dispatcher(
     disp = db.query(Dispatcher).filter(Dispatcher.id == dispatcher_id).first()
     if not disp:
         raise HTTPException(status_code=404, detail="Dispatcher not found")
+    target_username = disp.username
     db.delete(disp)
     db.commit()
+    audit_log.record("dispatcher.reject", current_dispatcher,
+                     target_id=dispatcher_id, target_username=target_username)
     return RedirectResponse(url="/dispatcher/dashboard", status_code=302)
 
-@app.post("/dispatcher/logout")
+@router.post("/dispatcher/logout")
 async def dispatcher_logout():
     response = RedirectResponse(url="/", status_code=302)
     response.delete_cookie(key="access_token")
     return response
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if AUTO_MIGRATE:
+        from migrate import migrate
+        await asyncio.to_thread(migrate)
+    await audit_log.start()
+    await asyncio.to_thread(load_manifest)
+    await asyncio.to_thread(vehicle_index.load)
+    await rollups.start()
+    await payment_service.start()
+    await backup_scheduler.start()
+    yield
+    await backup_scheduler.stop()
+    await admission.stop()
+    await payment_service.stop()
+    await rollups.stop()
+    await audit_log.stop()
+
+
+def create_app() -> FastAPI:
+    app = FastAPI(title="Bus Ticket System", lifespan=lifespan)
+
+    # Shed load before any work is done for the request
+    app.add_middleware(LoadSheddingMiddleware, controller=admission)
+
+    # Compress dynamic text responses (precompressed static files and binary exports are passed through)
+    app.add_middleware(TextGZipMiddleware, minimum_size=int(os.getenv("COMPRESS_MIN_SIZE", "1024")), compresslevel=6)
+
+    # Mount static files
+    app.mount("/static", PrecompressedStaticFiles(directory="static"), name="static")
+
+    app.include_router(router)
+    return app
+
+
+app = create_app()
+
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
@@ -0,0 +1,69 @@
+from sqlalchemy import bindparam, inspect, text
+from sqlalchemy.engine import Engine
+
+from database import engine
+from models import Base, Ticket
+from phones import normalize_phone
+
+BACKFILL_BATCH_SIZE = 1000
+
+
+def add_missing_columns(bind: Engine = engine):
+    """Add nullable columns and indexes that were added to models after
+    their table had been created (create_all skips existing tables)."""
+    inspector = inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=bind.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+
+def backfill_phone_numbers(bind: Engine = engine, batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """Fill Ticket.passenger_phone_normalized for rows created before it existed."""
+    updated = 0
+    last_id = 0
+    while True:
+        with bind.begin() as conn:
+            rows = conn.execute(
+                text("SELECT id, passenger_phone FROM tickets "
+                     "WHERE passenger_phone_normalized IS NULL AND id > :last_id "
+                     "ORDER BY id LIMIT :limit"),
+                {"last_id": last_id, "limit": batch_size}
+            ).fetchall()
+            if not rows:
+                return updated
+            last_id = rows[-1][0]
+            params = []
+            for row_id, phone in rows:
+                normalized = normalize_phone(phone)
+                if normalized:
+                    params.append({"ticket_id": row_id, "phone": normalized})
+            if params:
+                conn.execute(
+                    Ticket.__table__.update()
+                    .where(Ticket.__table__.c.id == bindparam("ticket_id"))
+                    .values(passenger_phone_normalized=bindparam("phone")),
+                    params
+                )
+                updated += len(params)
+
+
+def migrate(bind: Engine = engine):
+    """Bring the schema up to date. Run once per deploy rather than on every import."""
+    Base.metadata.create_all(bind=bind)
+    add_missing_columns(bind)
+    backfill_phone_numbers(bind)
+
+
+if __name__ == "__main__":
+    migrate()
+    print("Database schema is up to date")
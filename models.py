@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Date, Float, Enum
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Date, Float, Enum, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
@@ -28,7 +28,7 @@ class Trip(Base):
     id = Column(Integer, primary_key=True, index=True)
     departure_city = Column(String, nullable=False)
     arrival_city = Column(String, nullable=False)
-    departure_date = Column(Date, nullable=False)
+    departure_date = Column(Date, nullable=False, index=True)
     departure_time = Column(String, nullable=False)  # Format: HH:MM
     arrival_time = Column(String, nullable=False)    # Format: HH:MM
     bus_number = Column(String, nullable=False)      # Гос. номер автобуса
@@ -48,16 +48,45 @@ class Ticket(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     ticket_number = Column(String, unique=True, index=True)  # 001-999
-    trip_id = Column(Integer, ForeignKey("trips.id"))
+    trip_id = Column(Integer, ForeignKey("trips.id"), index=True)
     passenger_name = Column(String, nullable=False)
     passenger_phone = Column(String, nullable=False)
+    passenger_phone_normalized = Column(String, nullable=True, index=True)  # E.164, used for search
     boarding_point = Column(String, nullable=False)
     status = Column(String, default="pending_confirmation")  # pending_confirmation, confirmed, completed, cancelled
     status_reason = Column(Text, nullable=True)
     payment_status = Column(String, default="unpaid")  # unpaid, paid, refunded
     payment_amount = Column(Float, default=0.0)
+    payment_intent_id = Column(String, nullable=True, index=True)  # idempotency key sent to the gateway
     is_open_date = Column(Integer, default=0)  # 1 = open date ticket
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
     trip = relationship("Trip", back_populates="tickets")
+
+class AuditEvent(Base):
+    __tablename__ = "audit_events"
+
+    id = Column(Integer, primary_key=True)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    event_type = Column(String, nullable=False)        # e.g. ticket.status, trip.edit
+    dispatcher_id = Column(Integer, nullable=True, index=True)
+    trip_id = Column(Integer, nullable=True, index=True)
+    ticket_id = Column(Integer, nullable=True, index=True)
+    data = Column(Text, nullable=True)                 # JSON payload
+
+class RouteDailyStats(Base):
+    """Per route / day / departure hour aggregates maintained by analytics.py."""
+    __tablename__ = "route_daily_stats"
+    __table_args__ = (UniqueConstraint("day", "departure_city", "arrival_city", "hour"),)
+
+    id = Column(Integer, primary_key=True)
+    day = Column(Date, nullable=False, index=True)
+    departure_city = Column(String, nullable=False)
+    arrival_city = Column(String, nullable=False)
+    hour = Column(Integer, nullable=False)             # departure hour, 0-23
+    trips = Column(Integer, nullable=False, default=0)
+    seats_total = Column(Integer, nullable=False, default=0)
+    seats_sold = Column(Integer, nullable=False, default=0)
+    tickets_paid = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0.0)
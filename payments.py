@@ -0,0 +1,284 @@
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+import random
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import sessionmaker
+
+from database import SessionLocal
+from models import Ticket, Trip
+from audit import audit_log
+from analytics import rollups
+from phones import phone_search_cache
+
+logger = logging.getLogger(__name__)
+
+# Payment settings (override via environment)
+PAYMENT_WORKERS = int(os.getenv("PAYMENT_WORKERS", "8"))
+PAYMENT_MAX_RETRIES = int(os.getenv("PAYMENT_MAX_RETRIES", "3"))
+PAYMENT_TIMEOUT = float(os.getenv("PAYMENT_TIMEOUT", "10.0"))
+PAYMENT_COMMIT_BATCH = int(os.getenv("PAYMENT_COMMIT_BATCH", "50"))
+PAYMENT_COMMIT_INTERVAL = float(os.getenv("PAYMENT_COMMIT_INTERVAL", "0.2"))
+PAYMENT_WEBHOOK_SECRET = os.getenv("PAYMENT_WEBHOOK_SECRET")  # webhooks are refused when unset
+
+# Simulated gateway settings
+GATEWAY_LATENCY = float(os.getenv("GATEWAY_LATENCY", "0.5"))
+GATEWAY_JITTER = float(os.getenv("GATEWAY_JITTER", "0.2"))
+GATEWAY_FAILURE_RATE = float(os.getenv("GATEWAY_FAILURE_RATE", "0.0"))
+
+
+@dataclass
+class PaymentIntent:
+    ticket_id: int
+    amount: float
+    method: str = "sbp"  # sbp, card
+    intent_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    attempts: int = 0
+    recovered: bool = False  # resubmitted after a restart, the gateway may have charged it already
+
+
+@dataclass
+class GatewayResult:
+    intent_id: str
+    ticket_id: int
+    status: str  # paid, failed, pending
+    error: Optional[str] = None
+
+
+class GatewayError(Exception):
+    """Transient gateway failure, the intent may be retried."""
+
+
+class PaymentGateway(ABC):
+    """Base gateway interface.
+
+    `charge` returns "paid"/"failed" for synchronous gateways, or "pending"
+    when the final status will arrive later through the webhook. The
+    intent id is the idempotency key: charging the same intent twice must
+    not take the money twice.
+    """
+
+    @abstractmethod
+    async def charge(self, intent: PaymentIntent) -> GatewayResult:
+        ...
+
+    @abstractmethod
+    async def status(self, intent_id: str) -> Optional[GatewayResult]:
+        """Result of an earlier charge, None if the gateway never received it."""
+
+
+class SimulatedGateway(PaymentGateway):
+    """Local gateway stub with configurable latency and failure rate."""
+
+    def __init__(self, latency: float = GATEWAY_LATENCY, jitter: float = GATEWAY_JITTER,
+                 failure_rate: float = GATEWAY_FAILURE_RATE, decline_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.decline_rate = decline_rate
+        self.charges: Dict[str, GatewayResult] = {}
+
+    async def charge(self, intent: PaymentIntent) -> GatewayResult:
+        delay = max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+        await asyncio.sleep(delay)
+        if intent.intent_id in self.charges:
+            return self.charges[intent.intent_id]
+        if random.random() < self.failure_rate:
+            raise GatewayError("Шлюз временно недоступен")
+        if random.random() < self.decline_rate:
+            result = GatewayResult(intent.intent_id, intent.ticket_id, "failed", "Платёж отклонён банком")
+        else:
+            result = GatewayResult(intent.intent_id, intent.ticket_id, "paid")
+        self.charges[intent.intent_id] = result
+        return result
+
+    async def status(self, intent_id: str) -> Optional[GatewayResult]:
+        return self.charges.get(intent_id)
+
+
+def sign_webhook(body: bytes, secret: Optional[str] = PAYMENT_WEBHOOK_SECRET) -> str:
+    if not secret:
+        raise ValueError("PAYMENT_WEBHOOK_SECRET is not set")
+    return hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def verify_webhook(body: bytes, signature: Optional[str], secret: Optional[str] = PAYMENT_WEBHOOK_SECRET) -> bool:
+    if not secret or not signature:
+        return False
+    return hmac.compare_digest(sign_webhook(body, secret), signature)
+
+
+class PaymentService:
+    """Queue of payment intents processed by a bounded pool of workers.
+
+    Gateway results are buffered and written back to `Ticket` in batches
+    by a single committer task, so the HTTP handler never waits on the gateway.
+    """
+
+    def __init__(self, gateway: PaymentGateway, session_factory: sessionmaker = SessionLocal,
+                 workers: int = PAYMENT_WORKERS, max_retries: int = PAYMENT_MAX_RETRIES,
+                 timeout: float = PAYMENT_TIMEOUT, commit_batch: int = PAYMENT_COMMIT_BATCH,
+                 commit_interval: float = PAYMENT_COMMIT_INTERVAL):
+        self.gateway = gateway
+        self.session_factory = session_factory
+        self.workers = workers
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.commit_batch = commit_batch
+        self.commit_interval = commit_interval
+
+        self.queue: Optional[asyncio.Queue] = None
+        self.results: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self.stats: Dict[str, int] = {"enqueued": 0, "paid": 0, "failed": 0, "retries": 0, "commits": 0}
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        self.results = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._committer()))
+
+        # The queue only lives in memory: tickets left in "processing" by a
+        # restart or crash are resubmitted under their stored intent id, so
+        # the gateway is asked for the outcome before anything is charged
+        for ticket_id, amount, intent_id in await asyncio.to_thread(self._stale_intents):
+            await self.submit(PaymentIntent(ticket_id=ticket_id, amount=amount, intent_id=intent_id,
+                                            recovered=True))
+
+    def _stale_intents(self) -> List[tuple]:
+        db = self.session_factory()
+        try:
+            tickets = db.query(Ticket).filter(Ticket.payment_status == "processing").order_by(Ticket.id).all()
+            for ticket in tickets:
+                if not ticket.payment_intent_id:
+                    # Queued before intent ids were stored; the gateway never saw this key
+                    ticket.payment_intent_id = uuid.uuid4().hex
+            stale = [(t.id, t.payment_amount, t.payment_intent_id) for t in tickets]
+            db.commit()
+            return stale
+        finally:
+            db.close()
+
+    async def stop(self):
+        """Drain pending intents and flush results before shutting down."""
+        if self.queue is None:
+            return
+        await self.queue.join()
+        try:
+            await asyncio.wait_for(self.results.join(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            # Unsaved results are recovered on the next start()
+            logger.warning("Stopping with %d payment results not committed", self.results.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, intent: PaymentIntent):
+        self.stats["enqueued"] += 1
+        await self.queue.put(intent)
+
+    async def report(self, result: GatewayResult):
+        """Accept a final status from the webhook."""
+        await self.results.put(result)
+
+    async def _worker(self):
+        while True:
+            intent = await self.queue.get()
+            try:
+                result = await self._charge_with_retries(intent)
+                if result.status != "pending":
+                    await self.results.put(result)
+            finally:
+                self.queue.task_done()
+
+    async def _charge_with_retries(self, intent: PaymentIntent) -> GatewayResult:
+        if intent.recovered:
+            try:
+                result = await asyncio.wait_for(self.gateway.status(intent.intent_id), timeout=self.timeout)
+            except (GatewayError, asyncio.TimeoutError):
+                result = None  # charging under the same intent id is still safe
+            if result is not None:
+                return result
+        while True:
+            intent.attempts += 1
+            try:
+                return await asyncio.wait_for(self.gateway.charge(intent), timeout=self.timeout)
+            except (GatewayError, asyncio.TimeoutError) as e:
+                if intent.attempts > self.max_retries:
+                    logger.warning("Payment %s for ticket %s failed: %r", intent.intent_id, intent.ticket_id, e)
+                    return GatewayResult(intent.intent_id, intent.ticket_id, "failed", str(e) or "timeout")
+                self.stats["retries"] += 1
+                await asyncio.sleep(min(2.0, 0.1 * 2 ** (intent.attempts - 1)))
+
+    async def _committer(self):
+        while True:
+            batch = [await self.results.get()]
+            deadline = asyncio.get_running_loop().time() + self.commit_interval
+            while len(batch) < self.commit_batch:
+                remaining = deadline - asyncio.get_running_loop().time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.results.get(), timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await asyncio.to_thread(self._commit, batch)
+            except Exception:
+                # Put the results back and retry after a pause instead of
+                # leaving the tickets in "processing"
+                logger.exception("Failed to commit %d payment results, retrying", len(batch))
+                for result in batch:
+                    self.results.put_nowait(result)
+                await asyncio.sleep(1.0)
+            finally:
+                for _ in batch:
+                    self.results.task_done()
+
+    def _commit(self, batch: List[GatewayResult]):
+        by_status: Dict[str, List[int]] = {}
+        for result in batch:
+            by_status.setdefault(result.status, []).append(result.ticket_id)
+
+        db = self.session_factory()
+        try:
+            for payment_status, ticket_ids in by_status.items():
+                # Only tickets still awaiting the gateway are updated, so
+                # duplicate webhook deliveries are harmless.
+                db.query(Ticket).filter(
+                    Ticket.id.in_(ticket_ids),
+                    Ticket.payment_status == "processing"
+                ).update({Ticket.payment_status: payment_status}, synchronize_session=False)
+            batch_ids = [result.ticket_id for result in batch]
+            days = [d for (d,) in db.query(Trip.departure_date).join(Ticket, Ticket.trip_id == Trip.id).filter(
+                Ticket.id.in_(batch_ids)
+            ).distinct()]
+            phones = [p for (p,) in db.query(Ticket.passenger_phone_normalized).filter(
+                Ticket.id.in_(batch_ids), Ticket.passenger_phone_normalized.isnot(None)
+            ).distinct()]
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+        rollups.mark_dirty(*days)
+        phone_search_cache.invalidate(*phones)
+        self.stats["commits"] += 1
+        for payment_status, ticket_ids in by_status.items():
+            if payment_status in self.stats:
+                self.stats[payment_status] += len(ticket_ids)
+        for result in batch:
+            audit_log.record("ticket.payment", ticket_id=result.ticket_id, intent_id=result.intent_id,
+                             status=result.status, error=result.error)
+
+
+payment_service = PaymentService(SimulatedGateway())
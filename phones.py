@@ -0,0 +1,72 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+PHONE_SEARCH_CACHE_TTL = float(os.getenv("PHONE_SEARCH_CACHE_TTL", "30"))
+PHONE_SEARCH_CACHE_SIZE = int(os.getenv("PHONE_SEARCH_CACHE_SIZE", "10000"))
+
+_NON_DIGITS = re.compile(r"\D")
+
+
+def normalize_phone(raw: Optional[str]) -> Optional[str]:
+    """Canonical E.164 form of a phone number, or None if it is not one.
+
+    Russian numbers may be typed as "+7 (912) 000-00-00", "8 912 000 00 00"
+    or just "9120000000"; all of them become "+79120000000". Other numbers
+    are accepted only with an explicit leading "+".
+    """
+    if not raw:
+        return None
+    raw = raw.strip()
+    digits = _NON_DIGITS.sub("", raw)
+
+    if len(digits) == 11 and digits[0] in "78" and not (raw.startswith("+") and digits[0] == "8"):
+        return "+7" + digits[1:]
+    if len(digits) == 10 and not raw.startswith("+"):
+        return "+7" + digits
+    if raw.startswith("+") and 8 <= len(digits) <= 15:
+        return "+" + digits
+    return None
+
+
+class TTLCache:
+    """Small thread-safe LRU cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+
+# Ticket search results by normalised phone
+phone_search_cache = TTLCache(PHONE_SEARCH_CACHE_TTL, PHONE_SEARCH_CACHE_SIZE)
@@ -0,0 +1,107 @@
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from admission import AdmissionController, BookingError, BookingRequest
+
+
+class SlowController(AdmissionController):
+    """Commits take `commit_time` seconds and never touch the database."""
+
+    def __init__(self, commit_time: float, fail: bool = False, **kwargs):
+        super().__init__(**kwargs)
+        self.commit_time = commit_time
+        self.fail = fail
+        self.next_id = 0
+
+    def _commit_batch(self, trip_id, batch):
+        time.sleep(self.commit_time)
+        if self.fail:
+            return [BookingError("Нет доступных мест на этот рейс")] * len(batch)
+        results = []
+        for _ in batch:
+            self.next_id += 1
+            results.append(self.next_id)
+        return results
+
+
+def request(trip_id: int = 1) -> BookingRequest:
+    return BookingRequest(trip_id=trip_id, passenger_name="Иванов", passenger_phone="89120000000",
+                          boarding_point="Автовокзал")
+
+
+def test_drained_waiting_room_does_not_shed():
+    async def run():
+        controller = SlowController(commit_time=0.05, queue_size=5, batch_size=5, batch_wait=0,
+                                    shed_latency=0.5, shed_queue_depth=10000)
+        requests = [controller.submit(request()) for _ in range(100)]
+        assert controller.depth == 100
+        assert sum(r.future is None for r in requests) == 95  # parked in the waiting room
+
+        while controller.depth or controller.inflight:
+            await asyncio.sleep(0.05)
+        await controller.stop()
+
+        assert all(r.ticket_id for r in requests)
+        # The last passengers waited about a second, commits took 0.05 s
+        assert max(r.finished_at - r.created_at for r in requests) > controller.shed_latency
+        assert controller.latency.value < controller.shed_latency
+        assert not controller.overloaded()
+
+    asyncio.run(run())
+
+
+def test_timed_out_booking_hands_over_to_token():
+    async def run():
+        controller = SlowController(commit_time=0.2, fail=True, batch_wait=0)
+        booking = await controller.book(request(), timeout=0.05)
+        assert booking.future is None and not booking.done
+        assert controller.position(booking.token)["status"] == "processing"
+
+        while not booking.done:
+            await asyncio.sleep(0.05)
+        await controller.stop()
+        assert controller.position(booking.token)["status"] == "failed"
+
+    asyncio.run(run())
+
+
+def test_concurrent_trips_get_unique_ticket_numbers(tmp_path):
+    from datetime import date
+
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    from models import Base, Ticket, Trip
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'bookings.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    db = Session()
+    for trip_id in range(1, 9):
+        db.add(Trip(id=trip_id, departure_city="Ижевск", arrival_city="Глазов", departure_date=date.today(),
+                    departure_time="10:00", arrival_time="11:45", bus_number=f"А{trip_id:03d}АА18",
+                    bus_name="ПАЗ", bus_color="Белый", total_seats=50, available_seats=50, price=200.0))
+    db.commit()
+    db.close()
+
+    async def run():
+        controller = AdmissionController(session_factory=Session, batch_wait=0)
+        for _ in range(5):
+            bookings = await asyncio.gather(*(controller.book(request(trip_id))
+                                              for trip_id in range(1, 9) for _ in range(5)))
+            assert [b.error for b in bookings if b.error] == []
+        await controller.stop()
+
+    asyncio.run(run())
+
+    db = Session()
+    try:
+        assert db.query(Ticket).count() == 200
+        assert all(t.available_seats == 25 for t in db.query(Trip))
+    finally:
+        db.close()
+    engine.dispose()
@@ -0,0 +1,61 @@
+import asyncio
+import os
+import sys
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models import Base, Ticket, Trip
+from payments import GatewayResult, PaymentService, SimulatedGateway
+
+
+class CountingGateway(SimulatedGateway):
+    def __init__(self):
+        super().__init__(latency=0, jitter=0)
+        self.charged = []
+
+    async def charge(self, intent):
+        self.charged.append(intent.intent_id)
+        return await super().charge(intent)
+
+
+def prepare_db(path) -> sessionmaker:
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    db = Session()
+    trip = Trip(departure_city="Ижевск", arrival_city="Глазов", departure_date=date.today(),
+                departure_time="10:00", arrival_time="11:45", bus_number="У456ББ18", bus_name="ЛИАЗ-5256",
+                bus_color="Красный", total_seats=10, available_seats=8, price=200.0)
+    db.add(trip)
+    db.flush()
+    for number, intent_id in (("001", "charged-before-crash"), ("002", "never-sent")):
+        db.add(Ticket(ticket_number=number, trip_id=trip.id, passenger_name="Иванов",
+                      passenger_phone="89120000000", boarding_point="Автовокзал", payment_status="processing",
+                      payment_amount=200.0, payment_intent_id=intent_id))
+    db.commit()
+    db.close()
+    return Session
+
+
+def test_recovery_does_not_charge_twice(tmp_path):
+    Session = prepare_db(tmp_path / "payments.db")
+    gateway = CountingGateway()
+    gateway.charges["charged-before-crash"] = GatewayResult("charged-before-crash", 1, "paid")
+
+    async def run():
+        service = PaymentService(gateway, session_factory=Session, commit_interval=0)
+        await service.start()
+        await service.stop()
+
+    asyncio.run(run())
+
+    assert gateway.charged == ["never-sent"]
+    db = Session()
+    try:
+        assert [t.payment_status for t in db.query(Ticket).order_by(Ticket.id)] == ["paid", "paid"]
+    finally:
+        db.close()
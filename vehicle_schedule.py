@@ -0,0 +1,241 @@
+import os
+import sys
+import threading
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.orm import sessionmaker
+
+from database import SessionLocal
+from models import Trip
+
+# Minimum time between two trips of the same bus (override via environment)
+BUS_TURNAROUND_MINUTES = int(os.getenv("BUS_TURNAROUND_MINUTES", "0"))
+
+
+def normalize_bus_number(bus_number: str) -> str:
+    return "".join((bus_number or "").split()).upper()
+
+
+def parse_time(value: str) -> time:
+    """HH:MM (seconds are ignored); raises ValueError otherwise."""
+    hours, minutes = value.strip().split(":")[:2]
+    return time(int(hours), int(minutes))
+
+
+def trip_interval(departure_date: date, departure_time: str, arrival_time: str) -> Tuple[datetime, datetime]:
+    """Occupancy interval of a trip; an arrival at or before departure is the next day."""
+    start = datetime.combine(departure_date, parse_time(departure_time))
+    end = datetime.combine(departure_date, parse_time(arrival_time))
+    if end <= start:
+        end += timedelta(days=1)
+    return start, end
+
+
+@dataclass(frozen=True)
+class Slot:
+    start: datetime
+    end: datetime
+    trip_id: Optional[int] = None
+
+
+class BusTimeline:
+    """Trips of one bus as parallel lists sorted by departure.
+
+    A trip can only overlap [start, end) if it departs before `end` and
+    after `start - max_duration`, so an overlap check is a bisect plus a
+    look at the few trips in that window instead of a scan of the day.
+    """
+
+    def __init__(self):
+        self.starts: List[datetime] = []
+        self.slots: List[Slot] = []
+        self.max_duration = timedelta(0)  # upper bound, never shrinks on removal
+
+    def __len__(self):
+        return len(self.slots)
+
+    def add(self, slot: Slot):
+        i = bisect_right(self.starts, slot.start)
+        self.starts.insert(i, slot.start)
+        self.slots.insert(i, slot)
+        self.max_duration = max(self.max_duration, slot.end - slot.start)
+
+    def remove(self, slot: Slot):
+        i = bisect_left(self.starts, slot.start)
+        while i < len(self.slots) and self.starts[i] == slot.start:
+            if self.slots[i].trip_id == slot.trip_id:
+                del self.starts[i]
+                del self.slots[i]
+                return
+            i += 1
+
+    def overlapping(self, start: datetime, end: datetime, gap: timedelta = timedelta(0),
+                    exclude_trip_id: Optional[int] = None) -> List[Slot]:
+        lo = bisect_left(self.starts, start - gap - self.max_duration)
+        hi = bisect_left(self.starts, end + gap)
+        return [s for s in self.slots[lo:hi]
+                if s.end + gap > start and s.trip_id != exclude_trip_id]
+
+    def free_windows(self, start: datetime, end: datetime,
+                     gap: timedelta = timedelta(0)) -> List[Tuple[datetime, datetime]]:
+        """Periods inside [start, end) when a new trip of this bus could run."""
+        windows = []
+        cursor = start
+        lo = bisect_left(self.starts, start - gap - self.max_duration)
+        for slot in self.slots[lo:]:
+            if slot.start - gap >= end:
+                break
+            if slot.start - gap > cursor:
+                windows.append((cursor, slot.start - gap))
+            cursor = max(cursor, slot.end + gap)
+        if cursor < end:
+            windows.append((cursor, end))
+        return windows
+
+
+class VehicleIndex:
+    """Per-bus timelines of active trips, used to reject double bookings.
+
+    Loaded from the database on first use and then kept in step by the
+    trip create/edit/delete handlers. The index lives in the process, so
+    it assumes a single application process writes trips.
+    """
+
+    def __init__(self, session_factory: sessionmaker = SessionLocal,
+                 turnaround_minutes: int = BUS_TURNAROUND_MINUTES):
+        self.session_factory = session_factory
+        self.gap = timedelta(minutes=turnaround_minutes)
+        self._buses: Optional[Dict[str, BusTimeline]] = None
+        self._trips: Dict[int, Tuple[str, Slot]] = {}
+        self._lock = threading.RLock()
+
+    def load(self):
+        db = self.session_factory()
+        try:
+            rows = db.query(Trip.id, Trip.bus_number, Trip.departure_date, Trip.departure_time,
+                            Trip.arrival_time).filter(Trip.is_active == 1).all()
+        finally:
+            db.close()
+
+        buses: Dict[str, BusTimeline] = {}
+        trips: Dict[int, Tuple[str, Slot]] = {}
+        for trip_id, bus_number, departure_date, departure_time, arrival_time in rows:
+            bus = normalize_bus_number(bus_number)
+            slot = Slot(*trip_interval(departure_date, departure_time, arrival_time), trip_id)
+            buses.setdefault(bus, BusTimeline()).slots.append(slot)
+            trips[trip_id] = (bus, slot)
+        # Sort each timeline once instead of inserting trip by trip
+        for timeline in buses.values():
+            timeline.slots.sort(key=lambda slot: slot.start)
+            timeline.starts = [slot.start for slot in timeline.slots]
+            timeline.max_duration = max(slot.end - slot.start for slot in timeline.slots)
+
+        with self._lock:
+            self._buses = buses
+            self._trips = trips
+
+    def _timelines(self) -> Dict[str, BusTimeline]:
+        if self._buses is None:
+            self.load()
+        return self._buses
+
+    def _add(self, trip_id, bus_number, departure_date, departure_time, arrival_time):
+        bus = normalize_bus_number(bus_number)
+        slot = Slot(*trip_interval(departure_date, departure_time, arrival_time), trip_id)
+        self._buses.setdefault(bus, BusTimeline()).add(slot)
+        self._trips[trip_id] = (bus, slot)
+
+    def add_trip(self, trip: Trip):
+        with self._lock:
+            self._timelines()
+            self.remove_trip(trip.id)
+            if trip.is_active != 0:
+                self._add(trip.id, trip.bus_number, trip.departure_date, trip.departure_time, trip.arrival_time)
+
+    update_trip = add_trip
+
+    def remove_trip(self, trip_id: int):
+        with self._lock:
+            entry = self._trips.pop(trip_id, None)
+            if entry is not None:
+                bus, slot = entry
+                self._timelines()[bus].remove(slot)
+
+    def conflicts(self, bus_number: str, departure_date: date, departure_time: str, arrival_time: str,
+                  exclude_trip_id: Optional[int] = None) -> List[int]:
+        """Ids of active trips of the bus that overlap the proposed trip."""
+        start, end = trip_interval(departure_date, departure_time, arrival_time)
+        with self._lock:
+            timeline = self._timelines().get(normalize_bus_number(bus_number))
+            if timeline is None:
+                return []
+            return [s.trip_id for s in timeline.overlapping(start, end, self.gap, exclude_trip_id)]
+
+    def free_windows(self, bus_number: str, date_from: date, date_to: date,
+                     min_minutes: int = 0) -> List[Tuple[datetime, datetime]]:
+        """Free periods of the bus from the start of `date_from` to the end of `date_to`."""
+        start = datetime.combine(date_from, time.min)
+        end = datetime.combine(date_to + timedelta(days=1), time.min)
+        with self._lock:
+            timeline = self._timelines().get(normalize_bus_number(bus_number))
+            windows = timeline.free_windows(start, end, self.gap) if timeline else [(start, end)]
+        min_length = timedelta(minutes=min_minutes)
+        return [(a, b) for a, b in windows if b - a >= min_length]
+
+
+def _field(trip, name: str):
+    return trip.get(name) if isinstance(trip, dict) else getattr(trip, name, None)
+
+
+def validate_schedule(trips: Iterable, index: Optional[VehicleIndex] = None) -> List[Tuple]:
+    """Bulk check of a generated schedule.
+
+    `trips` are Trip objects or dicts with bus_number, departure_date,
+    departure_time and arrival_time. Returns (trip, other) pairs where
+    `other` is another trip of the batch or the id of an existing trip
+    from `index`. Each bus is sorted once and swept, O(n log n) overall.
+    """
+    gap = index.gap if index is not None else timedelta(minutes=BUS_TURNAROUND_MINUTES)
+
+    by_bus: Dict[str, List[Tuple[datetime, datetime, object]]] = {}
+    for trip in trips:
+        start, end = trip_interval(_field(trip, "departure_date"), _field(trip, "departure_time"),
+                                   _field(trip, "arrival_time"))
+        by_bus.setdefault(normalize_bus_number(_field(trip, "bus_number")), []).append((start, end, trip))
+
+    conflicts = []
+    for bus, items in by_bus.items():
+        items.sort(key=lambda item: item[0])
+        active: List[Tuple[datetime, datetime, object]] = []
+        for start, end, trip in items:
+            active = [a for a in active if a[1] + gap > start]
+            conflicts.extend((other, trip) for _, _, other in active)
+            active.append((start, end, trip))
+
+            if index is not None:
+                conflicts.extend((trip, other_id) for other_id in index.conflicts(
+                    bus, _field(trip, "departure_date"), _field(trip, "departure_time"),
+                    _field(trip, "arrival_time"), exclude_trip_id=_field(trip, "id")
+                ))
+    return conflicts
+
+
+vehicle_index = VehicleIndex()
+
+
+if __name__ == "__main__":
+    # Report buses already assigned to overlapping trips
+    db = SessionLocal()
+    try:
+        active_trips = db.query(Trip).filter(Trip.is_active == 1).all()
+        found = validate_schedule(active_trips)
+        for a, b in found:
+            print(f"{a.bus_number}: рейс #{a.id} {a.departure_date} {a.departure_time}-{a.arrival_time} "
+                  f"пересекается с #{b.id} {b.departure_date} {b.departure_time}-{b.arrival_time}")
+        print(f"Проверено рейсов: {len(active_trips)}, пересечений: {len(found)}")
+    finally:
+        db.close()
+    sys.exit(1 if found else 0)